@@ -1,8 +1,8 @@
 import os
 import datetime as dt
 import hq
-import dt_combiner
 import genbar
+import dt_combiner
 import task_update_etf_list
 from utils import chatbot
 
@@ -22,14 +22,16 @@ def job_worker(secu_type: str, quote_type: str, date_int: int):
         task_update_etf_list.write_etf_list()
 
     target_dates = [date_int]
-    # download quotes
-    hq.download(secu_type, quote_type, target_dates)
-    # proces data
-    dt_combiner.do_comine(secu_type, quote_type, target_dates)
+    # download quotes and combine them on the fly into transfer/
+    hq.download(secu_type, quote_type, target_dates, fused=True)
+    if not os.path.exists(dt_combiner.day_file(f"transfer/{secu_type}-{quote_type}", target_dates[0])):
+        # hq.download does not write a day it did not fully receive, see hq.is_whole
+        chatbot.send_msg(f"etf {quote_type} of {date_int} not combined, skip bar1m & bar15m")
+        return
     # dump bar1m
     genbar.gen_bar1m(target_dates[0], 1, f"transfer/{secu_type}-{quote_type}", f"transfer/{secu_type}-bar1m")
-    # dump bar15m
-    genbar.gen_bar(target_dates[0], 15, f"transfer/{secu_type}-bar1m", f"transfer/{secu_type}-bar15m")
+    # dump bar15m, add intervals here to emit them in the same pass over bar1m
+    genbar.gen_bars(target_dates[0], f"transfer/{secu_type}-bar1m", {15: f"transfer/{secu_type}-bar15m"})
     chatbot.send_msg(f"finish etf tick to bar1m & bar15m at {date_int}")
 
 
@@ -1,168 +1,372 @@
 import polars as pl
 import argparse
+import glob
+import functools
 import json
 import os
-from utils import chatbot
+import math
+import shutil
+import time
+from utils import book, chatbot, code_index, compact, deps, manifest, pool, tier, timestamp
 
 BS_FLAG_MAPPING = {"B": 1, "S": 2, "C": 3, "G": 4, "F": 5}
 ORDER_TYPE_MAPPING = {"1": 1, "2": 2, "U": 3, "A": 4, "D": 5}
+MEM_EXPANSION = 10  # peak memory of combining a day / its parquet chunk bytes, rough
 
 
-def combine_trade(target_date: int, in_dir: str, out_dir: str):
-    in_files = f"{in_dir}/{target_date}/*.parquet"
+def chunk_files(in_dir: str, target_date: int) -> list[str]:
+    """chunk files listed in the manifest of a sealed date, or every *.parquet of a date downloaded before manifests existed"""
+    date_manifest = manifest.read_manifest(f"{in_dir}/{target_date}")
+    if date_manifest is None:
+        return sorted(glob.glob(f"{in_dir}/{target_date}/*.parquet"))
+    return [f"{in_dir}/{target_date}/{file_name}" for file_name in date_manifest["files"]]
+
+
+def wait_sealed(in_dir: str, target_date: int, timeout: int, poll_seconds: int = 30) -> bool:
+    """wait until hq.download seals the date, False if it is not sealed within timeout seconds"""
+    deadline = time.time() + timeout
+    while not manifest.is_complete(f"{in_dir}/{target_date}"):
+        if time.time() > deadline:
+            return False
+        time.sleep(min(poll_seconds, max(0, deadline - time.time())))
+    return True
+
+
+def transform_trade(lf: pl.LazyFrame) -> pl.LazyFrame:
     # sh trade bs_flag: B, S
     # sz trade bs_flag: B, S, C
-    df = (
-        pl.scan_parquet(in_files)
-        .select(
-            pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
-            pl.col("seq_no").cast(pl.UInt64),
-            pl.col("price").cast(pl.UInt32),
-            pl.col("volume").cast(pl.UInt64),
-            pl.col("bs_flag").replace_strict(BS_FLAG_MAPPING, return_dtype=pl.UInt8),
-            pl.col("ask_seq_no").cast(pl.UInt64),
-            pl.col("bid_seq_no").cast(pl.UInt64),
-        )
-        .sort(["code", "dt"])
-        .collect()
+    return lf.select(
+        pl.col("code").cast(pl.UInt32),
+        timestamp.to_datetime("date", "time").alias("dt"),
+        pl.col("seq_no").cast(pl.UInt64),
+        pl.col("price").cast(pl.UInt32),
+        pl.col("volume").cast(pl.UInt64),
+        pl.col("bs_flag").replace_strict(BS_FLAG_MAPPING, return_dtype=pl.UInt8),
+        pl.col("ask_seq_no").cast(pl.UInt64),
+        pl.col("bid_seq_no").cast(pl.UInt64),
     )
 
-    final_dir = f"{out_dir}/{target_date // 10000}"
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"
-    df.write_ipc(out_file, compression="zstd")
-
 
-def combine_order(target_date: int, in_dir: str, out_dir: str):
-    in_files = f"{in_dir}/{target_date}/*.parquet"
+def transform_order(lf: pl.LazyFrame) -> pl.LazyFrame:
     # sh order bs_flag: B, S
     # sz order bs_flag: B, S
     # sh order order_type: 1, 2, U
     # sz order order_type: A, D
-    df = (
-        pl.scan_parquet(in_files)
-        .filter(pl.col("price").is_not_null())
-        .select(
-            pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
-            pl.col("seq_no").cast(pl.UInt64),
-            pl.col("price").cast(pl.UInt32),
-            pl.col("volume").cast(pl.UInt64),
-            pl.col("bs_flag").replace_strict(BS_FLAG_MAPPING, return_dtype=pl.UInt8),
-            pl.col("order_type").replace_strict(ORDER_TYPE_MAPPING, return_dtype=pl.UInt8),
-            pl.col("orgin_seq_no").cast(pl.UInt64),
-        )
-        .sort(["code", "dt"])
-        .collect()
+    return lf.filter(pl.col("price").is_not_null()).select(
+        pl.col("code").cast(pl.UInt32),
+        timestamp.to_datetime("date", "time").alias("dt"),
+        pl.col("seq_no").cast(pl.UInt64),
+        pl.col("price").cast(pl.UInt32),
+        pl.col("volume").cast(pl.UInt64),
+        pl.col("bs_flag").replace_strict(BS_FLAG_MAPPING, return_dtype=pl.UInt8),
+        pl.col("order_type").replace_strict(ORDER_TYPE_MAPPING, return_dtype=pl.UInt8),
+        pl.col("orgin_seq_no").cast(pl.UInt64),
+    )
+
+
+def transform_tick(lf: pl.LazyFrame, book_arrays: bool = False) -> pl.LazyFrame:
+    """book_arrays keeps every book side as one Array[UInt32, 10] column ap, bp, ..., instead of ap0..ap9, bp0..bp9, ..., see utils.book"""
+    return lf.filter((pl.col("open") != 0) & (pl.col("last") != 0)).select(
+        pl.col("code").cast(pl.UInt32),
+        timestamp.to_datetime("date", "time").alias("dt"),
+        pl.col("preclose").cast(pl.UInt32),
+        pl.col("open").cast(pl.UInt32),
+        pl.col("last").cast(pl.UInt32),
+        pl.col("iopv").fill_null(0).cast(pl.UInt32),
+        pl.col("high_limit").fill_null(0).cast(pl.UInt32),
+        pl.col("low_limit").fill_null(0).cast(pl.UInt32),
+        pl.col("num_trades").cast(pl.UInt32).fill_null(0),
+        pl.col("volume").cast(pl.UInt64).fill_null(0),
+        pl.col("total_ask_volume").cast(pl.UInt64).fill_null(0).alias("tot_av"),
+        pl.col("total_bid_volume").cast(pl.UInt64).fill_null(0).alias("tot_bv"),
+        pl.col("amount").cast(pl.UInt64).fill_null(0),
+        pl.col("ask_avg_price").cast(pl.UInt32).alias("avg_ap"),
+        pl.col("bid_avg_price").cast(pl.UInt32).alias("avg_bp"),
+        *(book.array_columns if book_arrays else book.level_columns)(lf.collect_schema().names()),
     )
-    final_dir = f"{out_dir}/{target_date // 10000}"
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"
-    df.write_ipc(out_file, compression="zstd")
-
-
-def combine_tick(target_date: int, in_dir: str, out_dir: str):
-    in_files = f"{in_dir}/{target_date}/*.parquet"
-
-    df = (
-        pl.scan_parquet(in_files)
-        .filter((pl.col("open") != 0) & (pl.col("last") != 0))
-        .select(
-            pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
-            pl.col("preclose").cast(pl.UInt32),
-            pl.col("open").cast(pl.UInt32),
-            pl.col("last").cast(pl.UInt32),
-            pl.col("iopv").fill_null(0).cast(pl.UInt32),
-            pl.col("high_limit").fill_null(0).cast(pl.UInt32),
-            pl.col("low_limit").fill_null(0).cast(pl.UInt32),
-            pl.col("num_trades").cast(pl.UInt32).fill_null(0),
-            pl.col("volume").cast(pl.UInt64).fill_null(0),
-            pl.col("total_ask_volume").cast(pl.UInt64).fill_null(0).alias("tot_av"),
-            pl.col("total_bid_volume").cast(pl.UInt64).fill_null(0).alias("tot_bv"),
-            pl.col("amount").cast(pl.UInt64).fill_null(0),
-            pl.col("ask_avg_price").cast(pl.UInt32).alias("avg_ap"),
-            pl.col("bid_avg_price").cast(pl.UInt32).alias("avg_bp"),
-            *[pl.col("ask_prices").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"ap{i}") for i in range(10)],
-            *[pl.col("bid_prices").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"bp{i}") for i in range(10)],
-            *[pl.col("ask_volumes").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"av{i}") for i in range(10)],
-            *[pl.col("bid_volumes").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"bv{i}") for i in range(10)],
-            *[pl.col("ask_nums").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"an{i}") for i in range(10)],
-            *[pl.col("bid_nums").list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"bn{i}") for i in range(10)],
-        )
-        .sort(["code", "dt"])
-        .collect()
+
+
+def transform_kl1m(lf: pl.LazyFrame) -> pl.LazyFrame:
+    return lf.with_columns(
+        pl.col("open").replace(-1, 0),
+        pl.col("high").replace(-1, 0),
+        pl.col("low").replace(-1, 0),
+        pl.col("last").replace(-1, 0),
+    ).select(
+        pl.col("code").cast(pl.UInt32),
+        timestamp.to_datetime("date", "time").alias("dt"),
+        pl.col("open").cast(pl.UInt32),
+        pl.col("high").cast(pl.UInt32),
+        pl.col("low").cast(pl.UInt32),
+        pl.col("last").cast(pl.UInt32),
+        pl.col("num_trades").cast(pl.UInt32),
+        pl.col("volume").cast(pl.UInt64),
+        pl.col("amount").cast(pl.UInt64),
     )
-    null_cont_sum = df.null_count().select("code", "dt", "preclose", "open", "last").sum_horizontal().item(0)
-    if null_cont_sum > 0:
-        chatbot.send_msg(f'{in_dir}/{target_date} null_count: {df.null_count().select("code", "dt", "preclose", "open", "last", "avg_ap", "avg_bp").to_dicts()}')
 
-    final_dir = f"{out_dir}/{target_date // 10000}"
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"
-    df.write_ipc(out_file, compression="zstd")
+
+# quote_type -> per-chunk transform, shared by the combiners and the fused mode of hq.download
+TRANSFORMS = {
+    "trade": transform_trade,
+    "order": transform_order,
+    "tick": transform_tick,
+    "kl1m": transform_kl1m,
+}
+
+
+# rows of a day are sorted by these, the chunks of several workers arrive in any order and the sort is not stable,
+# so every key set is unique within a day: one tick or bar per code and ms, seq_no breaks the ties of order & trade
+SORT_KEYS = {
+    "trade": ["code", "dt", "seq_no"],
+    "order": ["code", "dt", "seq_no"],
+    "tick": ["code", "dt"],
+    "kl1m": ["code", "dt"],
+}
+
+
+def get_transform(quote_type: str, book_arrays: bool = False):
+    """per-chunk transform of quote_type, with book_arrays the tick books are written as Array columns"""
+    if book_arrays:
+        return functools.partial(transform_tick, book_arrays=True)
+    return TRANSFORMS[quote_type]
+
+
+def check_nulls(quote_type: str, null_count: pl.DataFrame, label: str):
+    """report the unexpected nulls of a combined day, null_count is df.null_count() of the day"""
+    if quote_type == "tick":
+        null_cont_sum = null_count.select("code", "dt", "preclose", "open", "last").sum_horizontal().item(0)
+        if null_cont_sum > 0:
+            chatbot.send_msg(f'{label} null_count: {null_count.select("code", "dt", "preclose", "open", "last", "avg_ap", "avg_bp").to_dicts()}')
+    elif quote_type == "kl1m":
+        null_cont_sum = null_count.sum_horizontal().item(0)
+        if null_cont_sum > 0:
+            chatbot.send_msg(f"{label} null_count: {null_count.to_dicts()}")
+
+
+def day_file(out_dir: str, target_date: int) -> str:
+    return f"{out_dir}/{target_date // 10000}/{target_date}.ipc"  # transfer/etf-tick/2022/20220104.ipc
+
+
+def write_day(df: pl.DataFrame, out_dir: str, target_date: int, hot: bool = False, indexed: bool = False, compacted: bool = False):
+    """
+    write through a temp file and rename, an existing day file is always complete, a hot day is written uncompressed,
+    an indexed day is written as one record batch per code with a code index sidecar, see utils.code_index,
+    a compact day is written delta-encoded in narrow types with a manifest sidecar, see utils.compact
+    """
+    out_file = day_file(out_dir, target_date)
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    code_index.remove(out_file)
+    compact.remove(out_file)
+    df_out, compact_manifest = compact.encode(df) if compacted else (df, None)
+    (code_index.by_code(df_out) if indexed else df_out).write_ipc(f"{out_file}.tmp", compression=tier.compression(hot))
+    os.replace(f"{out_file}.tmp", out_file)
+    tier.mark(out_file, hot)
+    if compacted:
+        compact.write_manifest(compact_manifest, out_file)
+    if indexed:
+        code_index.write(df.lazy(), out_file)
+
+
+def rewrite_day(quote_type: str, target_date: int, out_dir: str, hot: bool = False, indexed: bool = False, compacted: bool = False, book_arrays: bool = False):
+    """
+    Rewrite a combined day in another layout from its own ipc, without its chunks, e.g. a fused day after -index or -hot changed.
+
+
+    The recorded inputs of the day stay, only its layout is recorded anew.
+    """
+    out_file = day_file(out_dir, target_date)
+    lf = compact.decode(pl.scan_ipc(out_file, memory_map=False), out_file)
+    if quote_type == "tick":
+        # the books are the last columns of transform_tick, as ap0..ap9, ... or as the Array columns ap, ...
+        names = lf.collect_schema().names()
+        book_names = {*book.LADDERS.values(), *(f"{prefix}{i}" for prefix in book.LADDERS.values() for i in range(book.LEVELS))}
+        lf = lf.select(*[name for name in names if name not in book_names], *(book.array_columns if book_arrays else book.level_columns)(names))
+    write_day(lf.collect(), out_dir, target_date, hot, indexed, compacted)
+    deps.relayout(out_file, deps.day_layout(hot, indexed, compacted, book_arrays))
+
+
+def combine(
+    quote_type: str,
+    target_date: int,
+    in_dir: str,
+    out_dir: str,
+    spill_gb: float = 0,
+    hot: bool = False,
+    indexed: bool = False,
+    compacted: bool = False,
+    book_arrays: bool = False,
+):
+    """
+    Combine one day, in memory, or partitioned by code range if its estimated memory exceeds spill_gb.\n\n
+    Args:
+        spill_gb: float, peak memory budget of the day, 0 means always in memory
+        hot: bool, write the day in the uncompressed hot tier, see utils.tier
+        indexed: bool, write the day with a code index, see utils.code_index
+        compacted: bool, write the day in the compact encoding, see utils.compact
+        book_arrays: bool, tick only, write the books as Array[UInt32, 10] columns ap, bp, ..., see utils.book
+    """
+    in_files = chunk_files(in_dir, target_date)
+    est_bytes = chunk_bytes(in_dir, target_date) * MEM_EXPANSION
+    if spill_gb > 0 and est_bytes > spill_gb * 1024**3:
+        combine_spilled(quote_type, target_date, in_dir, out_dir, math.ceil(est_bytes / (spill_gb * 1024**3)), hot, indexed, compacted, book_arrays)
+    else:
+        df = get_transform(quote_type, book_arrays)(pl.scan_parquet(in_files)).sort(SORT_KEYS[quote_type]).collect()
+        check_nulls(quote_type, df.null_count(), f"{in_dir}/{target_date}")
+        write_day(df, out_dir, target_date, hot, indexed, compacted)
+    deps.record(day_file(out_dir, target_date), in_files, deps.day_layout(hot, indexed, compacted, book_arrays))
+
+
+def combine_spilled(
+    quote_type: str,
+    target_date: int,
+    in_dir: str,
+    out_dir: str,
+    num_parts: int,
+    hot: bool = False,
+    indexed: bool = False,
+    compacted: bool = False,
+    book_arrays: bool = False,
+):
+    """
+    Out-of-core combine: split the day into num_parts contiguous code ranges, sort each range alone into an
+    uncompressed spill file, then stream the spills in code order into the final zstd ipc.\n\n
+    Peak memory is about 1/num_parts of the in-memory combine, the time cost is one more scan of the chunks
+    per part (the codes are not sorted inside the chunks, so the parquet statistics rarely skip a row group and every part
+    reads the code column of all chunks) plus writing & reading the spills once. A day without rows is written in memory.
+    The streamed record batches do not follow the codes, so an indexed day is written range by range as one record batch per code instead.
+    A compact day spills the per-code deltas of each range, a code lies in one range so they concatenate into the deltas of the day,
+    the narrow types are picked once from the bounds of all ranges while streaming.
+    """
+    lf = pl.scan_parquet(chunk_files(in_dir, target_date))
+    codes = lf.select(pl.col("code").unique().sort()).collect()["code"].to_list()  # 6-digit strings, sorted like the UInt32 codes
+    if not codes:
+        write_day(get_transform(quote_type, book_arrays)(lf).collect(), out_dir, target_date, hot, indexed, compacted)
+        return
+    part_size = math.ceil(len(codes) / num_parts)
+
+    out_file = day_file(out_dir, target_date)
+    spill_dir = f"{out_file}.spill"
+    os.makedirs(spill_dir, exist_ok=True)
+    spill_files, null_counts, part_manifests, column_bounds = [], [], [], None
+    for i in range(0, len(codes), part_size):
+        part_codes = codes[i : i + part_size]
+        df = get_transform(quote_type, book_arrays)(lf.filter(pl.col("code").is_between(pl.lit(part_codes[0]), pl.lit(part_codes[-1])))).sort(SORT_KEYS[quote_type]).collect()
+        null_counts.append(df.null_count())
+        if compacted:
+            df, part_manifest = compact.deltas(df)
+            column_bounds = compact.bounds(df, part_manifest, column_bounds)
+            part_manifests.append(part_manifest)
+        spill_files.append(f"{spill_dir}/{len(spill_files):04d}.ipc")
+        df.write_ipc(spill_files[-1], compression="uncompressed")
+        del df
+    check_nulls(quote_type, pl.concat(null_counts).sum(), f"{in_dir}/{target_date}")
+
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    code_index.remove(out_file)
+    compact.remove(out_file)
+    compact_manifest = max(part_manifests, key=lambda part_manifest: part_manifest["dt"]["day"]) if compacted else None  # an empty range has day 0
+    casts = compact.narrow(compact_manifest, column_bounds) if compacted else []
+    if indexed:
+        # range by range, so the record batches still follow the codes
+        parts = (pl.read_ipc(spill_file, memory_map=False).with_columns(casts) for spill_file in spill_files)
+        code_index.write_parts(parts, f"{out_file}.tmp", tier.compression(hot))
+    else:
+        pl.concat([pl.scan_ipc(spill_file) for spill_file in spill_files]).with_columns(casts).sink_ipc(f"{out_file}.tmp", compression=tier.compression(hot))
+    os.replace(f"{out_file}.tmp", out_file)
+    tier.mark(out_file, hot)
+    if compacted:
+        compact.write_manifest(compact_manifest, out_file)
+    if indexed:
+        code_index.write(compact.decode(pl.scan_ipc(out_file, memory_map=False), out_file), out_file)
+    shutil.rmtree(spill_dir)
+
+
+def combine_trade(target_date: int, in_dir: str, out_dir: str):
+    combine("trade", target_date, in_dir, out_dir)
+
+
+def combine_order(target_date: int, in_dir: str, out_dir: str):
+    combine("order", target_date, in_dir, out_dir)
+
+
+def combine_tick(target_date: int, in_dir: str, out_dir: str, book_arrays: bool = False):
+    combine("tick", target_date, in_dir, out_dir, book_arrays=book_arrays)
 
 
 def combine_kl1m(target_date: int, in_dir: str, out_dir: str):
-    in_files = f"{in_dir}/{target_date}/*.parquet"
-
-    df = (
-        pl.scan_parquet(in_files)
-        .with_columns(
-            pl.col("open").replace(-1, 0),
-            pl.col("high").replace(-1, 0),
-            pl.col("low").replace(-1, 0),
-            pl.col("last").replace(-1, 0),
-        )
-        .select(
-            pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
-            pl.col("open").cast(pl.UInt32),
-            pl.col("high").cast(pl.UInt32),
-            pl.col("low").cast(pl.UInt32),
-            pl.col("last").cast(pl.UInt32),
-            pl.col("num_trades").cast(pl.UInt32),
-            pl.col("volume").cast(pl.UInt64),
-            pl.col("amount").cast(pl.UInt64),
-        )
-        .sort(["code", "dt"])
-        .collect()
-    )
-    null_cont_sum = df.null_count().sum_horizontal().item(0)
-    if null_cont_sum > 0:
-        chatbot.send_msg(f"{in_dir}/{target_date} null_count: {df.null_count().to_dicts()}")
+    combine("kl1m", target_date, in_dir, out_dir)
+
 
-    final_dir = f"{out_dir}/{target_date // 10000}"
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"
-    df.write_ipc(out_file, compression="zstd")
+def chunk_bytes(in_dir: str, target_date: int) -> int:
+    return sum(os.path.getsize(in_file) for in_file in chunk_files(in_dir, target_date))
 
 
-def do_comine(secu_type: str, quote_type: str, target_dates: list[int]):
+def do_comine(
+    secu_type: str,
+    quote_type: str,
+    target_dates: list[int],
+    follow_timeout: int = 0,
+    num_procs: int = 1,
+    mem_gb: float = 0,
+    spill_gb: float = 0,
+    force: bool = False,
+    hot_days: int = 0,
+    indexed: bool = False,
+    compacted: bool = False,
+    book_arrays: bool = False,
+):
+    """
+    Combine the downloaded chunks of target_dates into transfer/{secu_type}-{quote_type}/{yyyy}/{date}.ipc.\n\n
+    Args:
+        follow_timeout: int, if > 0, wait up to follow_timeout seconds for each date to be sealed by a running hq.download
+        num_procs: int, number of days combined in parallel processes
+        mem_gb: float, memory budget of the parallel days, estimated as MEM_EXPANSION x chunk bytes per day, 0 means no limit
+        spill_gb: float, a day estimated above it is combined out-of-core by code range, 0 means always in memory
+        force: bool, recombine the days whose output is up to date with its chunks
+        hot_days: int, days among the last hot_days trading days are written in the uncompressed hot tier, 0 means none
+        indexed: bool, write every day with a code index for per-code reads, see utils.code_index
+        compacted: bool, write every order/trade day delta-encoded in narrow types, see utils.compact
+        book_arrays: bool, write the tick books as Array[UInt32, 10] columns ap, bp, ... instead of ap0..ap9, ..., see utils.book
+    """
     in_dir = f"{secu_type}/{quote_type}"  # etf/tick/
     out_dir = f"transfer/{secu_type}-{quote_type}"  # transfer/etf-tick/
-    if quote_type == "kl1m":
-        combiner = combine_kl1m
-    elif quote_type == "tick":
-        combiner = combine_tick
-    elif quote_type == "trade":
-        combiner = combine_trade
-    elif quote_type == "order":
-        combiner = combine_order
-    else:
+    if quote_type not in TRANSFORMS:
         raise ValueError(f"unknown quote_type: {quote_type}")
+    if compacted and quote_type not in ["order", "trade"]:
+        raise ValueError(f"compacted is for order and trade, not {quote_type}")
+    if book_arrays and quote_type != "tick":
+        raise ValueError(f"book_arrays is for tick, not {quote_type}")
+
+    hot_dates = tier.hot_dates(hot_days)
+    results = {}
 
-    for target_date in target_dates:
-        if not os.path.exists(f"{in_dir}/{target_date}"):
-            chatbot.send_msg(f"{secu_type}:{quote_type}:{target_date} not exist")
-            continue
+    def gen_jobs():
+        for target_date in target_dates:
+            if follow_timeout > 0 and not wait_sealed(in_dir, target_date, follow_timeout):
+                results[target_date] = f"not sealed in {follow_timeout}s"
+                continue
+            date_manifest = manifest.read_manifest(f"{in_dir}/{target_date}")
+            if date_manifest is not None and not date_manifest.get("complete", False):
+                results[target_date] = "not sealed"  # a download that stopped short, its chunks may miss rows
+                continue
+            if not os.path.exists(f"{in_dir}/{target_date}"):
+                results[target_date] = pool.MISSING
+                continue
+            if not chunk_files(in_dir, target_date):
+                results[target_date] = "no chunks"
+                continue
+            if not force and deps.is_fresh(day_file(out_dir, target_date), chunk_files(in_dir, target_date), deps.day_layout(target_date in hot_dates, indexed, compacted, book_arrays)):
+                results[target_date] = pool.UP_TO_DATE
+                continue
+            mem_bytes = chunk_bytes(in_dir, target_date) * MEM_EXPANSION
+            if spill_gb > 0:
+                mem_bytes = min(mem_bytes, int(spill_gb * 1024**3))
+            yield target_date, (quote_type, target_date, in_dir, out_dir, spill_gb, target_date in hot_dates, indexed, compacted, book_arrays), mem_bytes
 
-        try:
-            combiner(target_date, in_dir, out_dir)
-        except Exception as e:
-            chatbot.send_msg(f"{secu_type}:{quote_type}:{target_date} failed, {e}")
-    chatbot.send_msg(f"{secu_type}:{quote_type}:{target_dates[0]}~{target_dates[-1]} combiner done")
+    try:
+        results.update(pool.run_days(combine, gen_jobs(), num_procs, int(mem_gb * 1024**3)))
+    finally:
+        chatbot.send_msg(f"{secu_type}:{quote_type}:{target_dates[0]}~{target_dates[-1]} combiner done, {pool.summarize(results)}")
 
 
 def gen_dt_list(dt_start: int, dt_end: int) -> list[int]:
@@ -177,7 +381,7 @@ def gen_dt_list(dt_start: int, dt_end: int) -> list[int]:
 
 def process(args):
     target_dates = gen_dt_list(args.dt_start, args.dt_end)
-    do_comine(args.secu_type, args.quote_type, target_dates)
+    do_comine(args.secu_type, args.quote_type, target_dates, args.follow_timeout, args.num_procs, args.mem_gb, args.spill_gb, args.force, args.hot_days, args.indexed, args.compacted, args.book_arrays)
 
 
 if __name__ == "__main__":
@@ -186,6 +390,15 @@ if __name__ == "__main__":
     parser.add_argument("-dte", type=int, required=True, dest="dt_end", help="end date, 20240504")
     parser.add_argument("-st", type=str, required=True, dest="secu_type", choices=["stock", "etf"], help="security type")
     parser.add_argument("-qt", type=str, required=True, dest="quote_type", choices=["tick", "kl1m", "order", "trade"], help="quote type")
+    parser.add_argument("-follow", type=int, dest="follow_timeout", default=0, help="seconds to wait for each date to be sealed by a running download, 0 means no wait")
+    parser.add_argument("-j", type=int, dest="num_procs", default=1, help="number of days combined in parallel, default 1")
+    parser.add_argument("-mem", type=float, dest="mem_gb", default=0, help="memory budget in GB of the parallel days, 0 means no limit")
+    parser.add_argument("-spill", type=float, dest="spill_gb", default=0, help="memory budget in GB of one day, larger days are sorted by code range through spill files")
+    parser.add_argument("-force", dest="force", action="store_true", help="flag, recombine days that are up to date")
+    parser.add_argument("-hot", type=int, dest="hot_days", default=0, help="write the days among the last N trading days uncompressed for memory-mapped reads, 0 means none")
+    parser.add_argument("-index", dest="indexed", action="store_true", help="flag, write one record batch per code and a code index sidecar")
+    parser.add_argument("-compact", dest="compacted", action="store_true", help="flag, order/trade only, delta-encode seq_no and dt in narrow types with a manifest sidecar")
+    parser.add_argument("-book_array", dest="book_arrays", action="store_true", help="flag, tick only, write the books as Array[UInt32, 10] columns ap, bp, ... instead of 60 level columns")
 
     args = parser.parse_args()
     process(args)
@@ -1,8 +1,17 @@
 import os
+import itertools
 import datetime as dt
 import argparse
 import json
+import numpy as np
 import polars as pl
+from utils import deps, pool, session, tier, timestamp
+
+MEM_EXPANSION = 20  # peak memory of converting a day / its zstd ipc bytes, rough
+BATCH_DIVISORS = {"day": 1, "month": 100, "year": 10000}  # date // divisor is the batch key
+# columns read by the bar builders, projected at scan time
+BAR1M_TICK_COLUMNS = ["code", "dt", "preclose", "last", "volume", "amount", "num_trades"]
+BAR_COLUMNS = ["code", "dt", "preclose", "open", "high", "low", "close", "volume", "amount", "trades_count"]
 
 # remove 货币型
 excluded_list = [
@@ -37,169 +46,232 @@ excluded_list = [
 
 
 def gen_bar1m(target_date: int, minute_interval: int, in_dir: str, out_dir: str):
-    target_dt = dt.date(target_date // 10000, (target_date // 100) % 100, target_date % 100)
-    in_file = target_dt.strftime(f"{in_dir}/%Y/%Y%m%d.ipc")  # etf-tick/2022/20220104.ipc
-    df = pl.scan_ipc(in_file, memory_map=False).filter(~pl.col("code").is_in(excluded_list)).collect()  # read tick, df is sorted by [code, dt]
-
-    # duplicate the first row of each code to 8:00
-    df_first = (
-        df.group_by("code")
-        .first()
-        .with_columns(
-            pl.col("dt").dt.replace(hour=8),
-            volume=pl.lit(0, pl.UInt64),
-            amount=pl.lit(0, pl.UInt64),
-            num_trades=pl.lit(0, pl.UInt32),
-        )
-    )
+    gen_bar1m_days([target_date], in_dir, out_dir)
 
-    # change >=11:30:00 to 11:29:59.999
-    # change >=15:00:00 to 14:59:59.999
-    df_body = df.with_columns(
-        pl.when(
-            ((pl.col("dt").dt.hour() == 11) & (pl.col("dt").dt.minute() == 30)) | ((pl.col("dt").dt.hour() == 15) & (pl.col("dt").dt.minute() == 0)),
-        )
-        .then(
-            pl.col("dt").dt.replace(second=0, microsecond=0) - dt.timedelta(milliseconds=1),
-        )
-        .otherwise("dt")
-        .alias("dt")
+
+def gen_bar1m_days(target_dates: list[int], in_dir: str, out_dir: str, hot_dates: set[int] = frozenset()):
+    """tick to aligned bar1m for several days in one query, e.g. a month or a year of a backfill, output is still one file per day"""
+    in_files = {target_date: f"{in_dir}/{target_date // 10000}/{target_date}.ipc" for target_date in target_dates}  # etf-tick/2022/20220104.ipc
+    # read tick, every day is sorted by [code, dt], only the 7 columns of the bars are read out of the ~75
+    df = (
+        tier.scan_ipc(list(in_files.values()))
+        .select(BAR1M_TICK_COLUMNS)
+        .filter(~pl.col("code").is_in(excluded_list))
+        .collect()
     )
 
-    # concat the two dataframes
-    dff = pl.concat([df_first, df_body]).sort(by=["code", "dt"], maintain_order=True)  # maintain_order=True is important for multiple 14:59:59.999
-    # group by 1 minute
-
-    df_bar1m = (
-        dff.group_by_dynamic("dt", every="1m", period="1m", closed="left", label="right", group_by="code")
-        .agg(
-            [
-                pl.last("preclose").alias("preclose"),
-                pl.first("last").alias("open"),
-                pl.max("last").alias("high"),
-                pl.min("last").alias("low"),
-                pl.last("last").alias("close"),
-                pl.last("volume"),
-                pl.last("amount"),
-                pl.last("num_trades"),
-            ]
-        )
-        .sort(by=["code", "dt"])  # maintain_order=True is not necessary as dt will not be the same
-        .with_columns(
-            pl.col("volume").diff().over("code").cast(pl.UInt64),  # for single target_dt, no need to over("code", pl.col('dt').dt.date())
-            pl.col("amount").diff().over("code").cast(pl.UInt64) * 10000,  # change amount value to 0.0001 Yuan
-            pl.col("num_trades").diff().over("code").cast(pl.UInt32),
-        )
-        .rename({"num_trades": "trades_count"})
-        .filter(pl.col("volume").is_not_null())
+    df_aligned_bar1m = align_bar1m(df)
+    write_days(df_aligned_bar1m, in_files, out_dir, hot_dates)  # etf-bar1m/2022/20220104.ipc
+
+
+def align_bar1m(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Ticks sorted by [date, code, dt] to bar1m aligned on the session.A_SHARE labels for every code of every day, in one walk over the ticks.\n\n
+    A tick goes to the bar labeled by the right end of its minute, ticks of 11:30 and 15:00 go to the 11:30 and 15:00 bars,
+    volume/amount/trades_count of a bar are the increase of the cumulative fields since the code's last tick before the bar.
+    A slot without ticks takes the previous close, or the next one before the code's first bar, with zero volume.
+    """
+    num_slots = len(session.labels())
+    ms = df["dt"].to_physical().to_numpy()
+    day = ms // timestamp.MS_PER_DAY
+    # a code's day is a run of ticks, numbered 0, 0, ..., 1, 1, ...
+    is_start = (np.diff(df["code"].rle_id().to_numpy(), prepend=-1) != 0) | (np.diff(day, prepend=-1) != 0)
+    code_index = np.cumsum(is_start) - 1
+    code_start = np.flatnonzero(is_start)
+    codes = df["code"].gather(code_start)
+    num_codes = len(codes)
+
+    slot = session.slots(ms)
+
+    # bars are the runs of equal code_index x slot over the aligned ticks
+    ticks = np.flatnonzero(slot >= 0)
+    key = code_index[ticks] * num_slots + slot[ticks]
+    starts = np.flatnonzero(np.diff(key, prepend=-1))
+    first = ticks[starts]
+    last = ticks[np.flatnonzero(np.diff(key, append=-1))]
+    bars = key[starts]
+
+    # cumulative fields before the bar, 0 before the code's first tick
+    prev = np.maximum(first - 1, 0)
+    has_prev = (first > 0) & (code_index[prev] == code_index[first])
+
+    def increase(name: str) -> np.ndarray:
+        values = df[name].to_numpy()
+        full = np.zeros(num_codes * num_slots, dtype=values.dtype)
+        full[bars] = values[last] - np.where(has_prev, values[prev], 0).astype(values.dtype)
+        return full
+
+    prices = df["last"].to_numpy()
+    close = np.zeros(num_codes * num_slots, dtype=prices.dtype)
+    close[bars] = prices[last]
+    precloses = df["preclose"].to_numpy()
+    preclose = np.zeros(num_codes * num_slots, dtype=precloses.dtype)
+    preclose[bars] = precloses[last]
+
+    # forward fill then backward fill close and preclose within the code
+    has_bar = np.zeros((num_codes, num_slots), dtype=bool)
+    has_bar.flat[bars] = True
+    row_start = np.arange(num_codes)[:, None] * num_slots
+    source = np.maximum.accumulate(np.where(has_bar, row_start + np.arange(num_slots), -1), axis=1)
+    source = np.where(source < 0, row_start + has_bar.argmax(axis=1)[:, None], source).ravel()  # before the code's first bar
+    close = close[source]
+    preclose = preclose[source]
+
+    def fill_close(values: np.ndarray) -> np.ndarray:
+        full = close.copy()
+        full[bars] = values
+        return full
+
+    df_aligned_bar1m = pl.DataFrame(
+        {
+            "code": codes.gather(np.repeat(np.arange(num_codes), num_slots)),
+            "dt": pl.Series((np.repeat(day[code_start] * timestamp.MS_PER_DAY, num_slots) + np.tile(session.offsets(), num_codes)).astype("datetime64[ms]")),
+            "preclose": pl.Series(preclose, dtype=df["preclose"].dtype),
+            "open": pl.Series(fill_close(prices[first]), dtype=df["last"].dtype),
+            "high": pl.Series(fill_close(np.maximum.reduceat(prices[ticks], starts)), dtype=df["last"].dtype),
+            "low": pl.Series(fill_close(np.minimum.reduceat(prices[ticks], starts)), dtype=df["last"].dtype),
+            "close": pl.Series(close, dtype=df["last"].dtype),
+            "volume": pl.Series(increase("volume"), dtype=pl.UInt64),
+            "amount": pl.Series(increase("amount"), dtype=pl.UInt64) * 10000,  # change amount value to 0.0001 Yuan
+            "trades_count": pl.Series(increase("num_trades"), dtype=pl.UInt32),
+        }
     )
+    # codes without any aligned bar have no price at all
+    code_has_bar = pl.Series(np.repeat(has_bar.any(axis=1), num_slots))
+    return df_aligned_bar1m.with_columns(pl.when(code_has_bar).then(pl.col(["preclose", "open", "high", "low", "close"])))
+
 
-    # time base
-    # [09:31, ...11:30]
-    # [13:01, ...15:00]
-    dft = pl.concat(
-        [
-            pl.Series([dt.datetime.combine(target_dt, dt.time(9, 26))], dtype=pl.Datetime(time_unit="ms")),
-            pl.datetime_range(
-                start=dt.datetime.combine(target_dt, dt.time(9, 30)),
-                end=dt.datetime.combine(target_dt, dt.time(11, 30)),
-                closed="right",
-                interval="1m",
-                time_unit="ms",
-                eager=True,
-            ),
-            pl.datetime_range(
-                start=dt.datetime.combine(target_dt, dt.time(13, 0)),
-                end=dt.datetime.combine(target_dt, dt.time(15, 0)),
-                closed="right",
-                interval="1m",
-                time_unit="ms",
-                eager=True,
-            ),
-        ]
-    ).to_frame(name="dt")
-    # Cartesian product of uniqute code x datetime
-    dft_base = df.select(pl.col("code").unique()).join(dft, how="cross")
-
-    # df_bar1m aligned for single date
-    df_aligned_bar1m = (
-        dft_base.join(df_bar1m, on=["code", "dt"], how="left")
-        .with_columns(
-            pl.col("volume").fill_null(strategy="zero"),
-            pl.col("amount").fill_null(strategy="zero"),
-            pl.col("trades_count").fill_null(strategy="zero"),
-            pl.col("close").fill_null(strategy="forward").fill_null(strategy="backward").over("code"),
-            pl.col("preclose").fill_null(strategy="forward").fill_null(strategy="backward").over("code"),
-        )
-        .with_columns(
-            pl.col("open").fill_null(pl.col("close")).over("code"),
-            pl.col("high").fill_null(pl.col("close")).over("code"),
-            pl.col("low").fill_null(pl.col("close")).over("code"),
-        )
-    ).sort(by=["code", "dt"])
-
-    final_dir = f"{out_dir}/{target_dt.year}"  # etf-bar1m/2022
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"  # etf-bar1m/2022/20220104.ipc
-    df_aligned_bar1m.write_ipc(out_file, compression="zstd")
+def write_days(df: pl.DataFrame, in_files: dict[int, str], out_dir: str, hot_dates: set[int] = frozenset()):
+    """split the bars of several days into {out_dir}/{yyyy}/{date}.ipc, a day without bars still gets its empty file, hot_dates are written uncompressed"""
+    epoch = dt.date(1970, 1, 1)
+    df_days = df.with_columns((pl.col("dt").cast(pl.Int64) // timestamp.MS_PER_DAY).alias("day")).partition_by("day", as_dict=True, include_key=False)
+    for target_date, in_file in in_files.items():
+        target_dt = dt.date(target_date // 10000, (target_date // 100) % 100, target_date % 100)
+        final_dir = f"{out_dir}/{target_dt.year}"  # etf-barXm/2022
+        os.makedirs(final_dir, exist_ok=True)
+        out_file = f"{final_dir}/{target_date}.ipc"  # etf-barXm/2022/20220104.ipc
+        df_days.get(((target_dt - epoch).days,), df.clear()).write_ipc(f"{out_file}.tmp", compression=tier.compression(target_date in hot_dates))
+        os.replace(f"{out_file}.tmp", out_file)
+        tier.mark(out_file, target_date in hot_dates)
+        deps.record(out_file, [in_file], deps.day_layout(target_date in hot_dates))
 
 
 # bar1m to bar5m, bar10m, bar30m, bar1h, bar2h
 def gen_bar(target_date: int, minute_interval: int, in_dir: str, out_dir: str):
-    target_dt = dt.date(target_date // 10000, (target_date // 100) % 100, target_date % 100)
-    in_file = target_dt.strftime(f"{in_dir}/%Y/%Y%m%d.ipc")  # etf-bar1m/2022/20220104.ipc
-    df_aligned_bar1m = pl.read_ipc(in_file, memory_map=False)  # read bar1m, df is sorted by [code, dt]
-
-    df_bar = (
-        df_aligned_bar1m.filter(pl.col("dt").dt.time() > dt.time(9, 30))
-        .with_columns(
-            ((pl.cum_count("dt") - 1).over("code") // minute_interval).alias("count"),
-        )
-        .group_by(["code", "count"])
-        .agg(
-            [
-                pl.last("dt"),
-                pl.last("preclose"),
-                pl.first("open"),
-                pl.max("high"),
-                pl.min("low"),
-                pl.last("close"),
-                pl.sum("volume"),
-                pl.sum("amount"),
-                pl.sum("trades_count"),
-            ]
-        )
-        .select(pl.exclude("count"))
-    ).sort(by=["code", "dt"])
-
-    final_dir = f"{out_dir}/{target_dt.year}"  # etf-barXm/2022
-    os.makedirs(final_dir, exist_ok=True)
-    out_file = f"{final_dir}/{target_date}.ipc"  # etf-barXm/2022/20220104.ipc
-    df_bar.write_ipc(out_file, compression="zstd")
-
-
-def do_convert(secu_type: str, minute_interval: int, target_dates: list[int]):
-    if minute_interval == 1:
+    gen_bars_days([target_date], in_dir, {minute_interval: out_dir})
+
+
+def gen_bars(target_date: int, in_dir: str, out_dirs: dict[int, str]):
+    gen_bars_days([target_date], in_dir, out_dirs)
+
+
+def gen_bars_days(target_dates: list[int], in_dir: str, out_dirs: dict[int, str], hot_dates: set[int] = frozenset()):
+    """
+    bar1m to several intervals in one pass over several days, bar1m is read once and the minute index is computed once.\n\n
+    Args:
+        out_dirs: dict, minute_interval -> out_dir, e.g. {5: "transfer/etf-bar5m", 15: "transfer/etf-bar15m"}
+    """
+    in_files = {target_date: f"{in_dir}/{target_date // 10000}/{target_date}.ipc" for target_date in target_dates}  # etf-bar1m/2022/20220104.ipc
+    # read bar1m, every day is sorted by [code, dt]
+    # minute index within the code's day, shared by every interval, the call auction bar is dropped at scan time
+    df_indexed = (
+        tier.scan_ipc(list(in_files.values()))
+        .select(BAR_COLUMNS)
+        .filter(session.minute_of_day(pl.col("dt")) > session.A_SHARE.sessions[0][0])
+        .with_columns((pl.col("dt").cast(pl.Int64) // timestamp.MS_PER_DAY).alias("day"))
+        .with_columns((pl.cum_count("dt") - 1).over("day", "code").alias("index"))
+        .collect()
+    )
+
+    for minute_interval, out_dir in out_dirs.items():
+        df_bar = (
+            df_indexed.group_by(["day", "code", pl.col("index") // minute_interval])
+            .agg(
+                [
+                    pl.last("dt"),
+                    pl.last("preclose"),
+                    pl.first("open"),
+                    pl.max("high"),
+                    pl.min("low"),
+                    pl.last("close"),
+                    pl.sum("volume"),
+                    pl.sum("amount"),
+                    pl.sum("trades_count"),
+                ]
+            )
+            .select(pl.exclude("day", "index"))
+        ).sort(by=["code", "dt"])
+        write_days(df_bar, in_files, out_dir, hot_dates)  # etf-barXm/2022/20220104.ipc
+
+
+def do_convert(
+    secu_type: str,
+    minute_intervals: list[int],
+    target_dates: list[int],
+    num_procs: int = 1,
+    mem_gb: float = 0,
+    force: bool = False,
+    batch: str = "day",
+    hot_days: int = 0,
+):
+    """
+    Convert target_dates to transfer/{secu_type}-bar{minute_interval}m/{yyyy}/{date}.ipc for every minute_interval.\n\n
+    bar1m is converted first from tick, the other intervals are converted together from bar1m, one pass per batch of days.\n\n
+    Args:
+        minute_intervals: list[int], e.g. [1, 5, 15]
+        num_procs: int, number of batches converted in parallel processes
+        mem_gb: float, memory budget of the parallel batches, estimated as MEM_EXPANSION x input ipc bytes per batch, 0 means no limit
+        force: bool, reconvert the days whose output is up to date with its input, tick -> bar1m -> barXm is rebuilt along the chain
+        batch: str, "day", "month" or "year", the stale days of a month or a year are converted in one query for backfills
+        hot_days: int, days among the last hot_days trading days are written in the uncompressed hot tier, 0 means none
+    """
+    batch_divisor = BATCH_DIVISORS[batch]
+    hot_dates = tier.hot_dates(hot_days)
+    mem_budget = int(mem_gb * 1024**3)
+
+    def gen_batches(in_dir: str, out_dirs: dict[int, str], results: dict):
+        """(stale days, their stale out_dirs, mem_bytes) of every batch, lazily"""
+        for _, batch_dates in itertools.groupby(target_dates, key=lambda target_date: target_date // batch_divisor):
+            stale_dates, stale_dirs, mem_bytes = [], {}, 0
+            for target_date in batch_dates:
+                in_file = f"{in_dir}/{target_date // 10000}/{target_date}.ipc"
+                if not os.path.exists(in_file):
+                    results[target_date] = pool.MISSING
+                    continue
+                # only the intervals whose output is stale
+                day_stale_dirs = {
+                    minute_interval: out_dir
+                    for minute_interval, out_dir in out_dirs.items()
+                    if force or not deps.is_fresh(f"{out_dir}/{target_date // 10000}/{target_date}.ipc", [in_file], deps.day_layout(target_date in hot_dates))
+                }
+                if not day_stale_dirs:
+                    results[target_date] = pool.UP_TO_DATE
+                    continue
+                stale_dates.append(target_date)
+                stale_dirs.update(day_stale_dirs)
+                mem_bytes += os.path.getsize(in_file) * MEM_EXPANSION
+            if stale_dates:
+                yield stale_dates, stale_dirs, mem_bytes
+
+    if 1 in minute_intervals:
         # bar1m is special alignment
         in_dir = f"transfer/{secu_type}-tick"  # transfer/etf-tick/
         out_dir = f"transfer/{secu_type}-bar1m"  # transfer/etf-bar1m/
-        converter = gen_bar1m
-    else:
-        in_dir = f"transfer/{secu_type}-bar1m"
-        out_dir = f"transfer/{secu_type}-bar{minute_interval}m"  # transfer/etf-bar5m/
-        converter = gen_bar
-
-    for target_date in target_dates:
-        in_file = f"{in_dir}/{target_date // 10000}/{target_date}.ipc"
-        if not os.path.exists(in_file):
-            print(f"{in_file} not exist")
-            continue
+        results = {}
+        jobs = ((tuple(stale_dates), (stale_dates, in_dir, out_dir, hot_dates & set(stale_dates)), mem_bytes) for stale_dates, _, mem_bytes in gen_batches(in_dir, {1: out_dir}, results))
+        batch_results = pool.run_days(gen_bar1m_days, jobs, num_procs, mem_budget)
+        results.update({target_date: reason for stale_dates, reason in batch_results.items() for target_date in stale_dates})
+        print(f"{secu_type}:bar1m:{target_dates[0]}~{target_dates[-1]} convert done, {pool.summarize(results)}")
 
-        try:
-            converter(target_date, minute_interval, in_dir, out_dir)
-        except Exception as e:
-            print(f"convert to bar{minute_interval}m of {in_file} failed, {e}")
-    print(f"{secu_type}:tick:{target_dates[0]}~{target_dates[-1]} combiner done")
+    intervals = sorted(set(minute_intervals) - {1})
+    if intervals:
+        in_dir = f"transfer/{secu_type}-bar1m"
+        out_dirs = {minute_interval: f"transfer/{secu_type}-bar{minute_interval}m" for minute_interval in intervals}  # transfer/etf-bar5m/
+        results = {}
+        jobs = ((tuple(stale_dates), (stale_dates, in_dir, stale_dirs, hot_dates & set(stale_dates)), mem_bytes) for stale_dates, stale_dirs, mem_bytes in gen_batches(in_dir, out_dirs, results))
+        batch_results = pool.run_days(gen_bars_days, jobs, num_procs, mem_budget)
+        results.update({target_date: reason for stale_dates, reason in batch_results.items() for target_date in stale_dates})
+        print(f"{secu_type}:bar{','.join(map(str, intervals))}m:{target_dates[0]}~{target_dates[-1]} convert done, {pool.summarize(results)}")
 
 
 def gen_dt_list(dt_start: int, dt_end: int) -> list[int]:
@@ -214,15 +286,20 @@ def gen_dt_list(dt_start: int, dt_end: int) -> list[int]:
 
 def process(args):
     target_dates = gen_dt_list(args.dt_start, args.dt_end)
-    do_convert(args.secu_type, args.minute_interval, target_dates)
+    do_convert(args.secu_type, args.minute_intervals, target_dates, args.num_procs, args.mem_gb, args.force, args.batch, args.hot_days)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="tick to bar")
     parser.add_argument("-dts", type=int, required=True, dest="dt_start", help="start date, 20070104")
     parser.add_argument("-dte", type=int, required=True, dest="dt_end", help="end date, 20240504")
-    parser.add_argument("-mi", type=int, required=True, dest="minute_interval", choices=[1, 5, 15, 30, 60, 120], help="bar interval in minutes: 1, 5, 15, 30, 60, 120")
+    parser.add_argument("-mi", type=int, nargs="+", required=True, dest="minute_intervals", choices=[1, 5, 15, 30, 60, 120], help="bar intervals in minutes: 1, 5, 15, 30, 60, 120, several in one pass, e.g. -mi 1 5 15")
     parser.add_argument("-st", type=str, dest="secu_type", default="etf", choices=["stock", "etf"], help="security type")
+    parser.add_argument("-j", type=int, dest="num_procs", default=1, help="number of batches converted in parallel, default 1")
+    parser.add_argument("-mem", type=float, dest="mem_gb", default=0, help="memory budget in GB of the parallel batches, 0 means no limit")
+    parser.add_argument("-force", dest="force", action="store_true", help="flag, reconvert days that are up to date")
+    parser.add_argument("-batch", type=str, dest="batch", default="day", choices=list(BATCH_DIVISORS), help="days converted in one query: day, month, year, default day")
+    parser.add_argument("-hot", type=int, dest="hot_days", default=0, help="write the days among the last N trading days uncompressed for memory-mapped reads, 0 means none")
 
     args = parser.parse_args()
     process(args)
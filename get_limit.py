@@ -9,7 +9,7 @@ import argparse
 import json
 import eqapi
 import polars as pl
-from utils import chatbot
+from utils import chatbot, quote_fields, session
 
 
 def get_logger(name: str, level=logging.DEBUG, fmt="%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(funcName)s - %(message)s"):
@@ -54,8 +54,8 @@ class HistoryApp(eqapi.HqApplication):
 
     def onQuote(self, quotes):
         self._quotes_q.put(quotes)
-        head_j = json.loads(quotes[0])
-        self.hq_logger.debug(f"receive {len(quotes)} quotes from server at {head_j['3']}")
+        if self.hq_logger.isEnabledFor(logging.DEBUG):
+            self.hq_logger.debug(f"receive {len(quotes)} quotes from server at {quote_fields.extract_date(quotes[0])}")
 
     def onError(self, msg):
         self.eq_logger.error(msg)
@@ -185,9 +185,9 @@ def download(secu_type: str, quote_type: str, target_dates: list[int]):
         hq_app.get(
             line=line,
             startDate=target_date,
-            startTime=92500000,
+            startTime=session.AUCTION_MATCH_TIME,
             endDate=target_date,
-            endTime=150100000,
+            endTime=session.END_TIME,
             rate=-1,  # unsorted
         )
         hq_app.wait()
@@ -1,7 +1,8 @@
 import os
-import io
+import re
+import shutil
 import threading
-from queue import Queue
+from queue import Empty, Queue
 import configparser
 import logging
 import datetime as dt
@@ -9,7 +10,8 @@ import argparse
 import json
 import eqapi
 import polars as pl
-from utils import chatbot
+import dt_combiner
+from utils import book, chatbot, deps, manifest, quote_fields, session, tier
 
 
 def get_logger(name: str, level=logging.DEBUG, fmt="%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(funcName)s - %(message)s"):
@@ -30,7 +32,8 @@ class HistoryApp(eqapi.HqApplication):
         hq_setting = self._read_config("hq.cfg")
         super().__init__([hq_setting, hq_setting])
         self._quotes_q = q
-        self.eq_logger = get_logger("eq", fmt="%(asctime)s - %(message)s")
+        self.last_total = None  # quote count of the last get(), from the server log
+        self.eq_logger = logging.getLogger("eq")  # shared by every connection, configured once in download
         self.hq_logger = logging.getLogger("hq")
 
     def _read_config(self, configfile: str) -> eqapi.EqSetting:
@@ -54,8 +57,8 @@ class HistoryApp(eqapi.HqApplication):
 
     def onQuote(self, quotes):
         self._quotes_q.put(quotes)
-        head_j = json.loads(quotes[0])
-        self.hq_logger.debug(f"receive {len(quotes)} quotes from server at {head_j['3']}")
+        if self.hq_logger.isEnabledFor(logging.DEBUG):
+            self.hq_logger.debug(f"receive {len(quotes)} quotes from server at {quote_fields.extract_date(quotes[0])}")
 
     def onError(self, msg):
         self.eq_logger.error(msg)
@@ -65,40 +68,156 @@ class HistoryApp(eqapi.HqApplication):
         if "Server Log: data complete, total" in msg:
             idx = msg.find("Server Log")
             self.hq_logger.info(msg[idx:])
+            total = re.search(r"total\D*(\d+)", msg[idx:])
+            if total:
+                self.last_total = int(total.group(1))
 
 
-def worker(q: Queue, schema_mapping: dict, name_mapping: dict, output_dir: str):
-    count = 0
+class QuoteBuilder:
+    """
+    Decode quote batches straight into typed columns, flatten the 10-level book lists at ingest, or cast them to Array columns with book_arrays,
+    buffer the frames per date & exchange and coalesce them into one parquet file once target_mb is reached.
+    With a transform (fused mode), every batch goes through the combiner transform and stays in memory until pop_frames.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        schema_mapping: dict,
+        name_mapping: dict,
+        output_dir: str,
+        target_mb: int = 128,
+        transform=None,
+        book_arrays: bool = False,
+    ):
+        self._worker_id = worker_id
+        self._schema = schema_mapping
+        self._names = name_mapping
+        self._output_dir = output_dir
+        self._target_bytes = target_mb * 1024 * 1024
+        self._transform = transform
+        self._book_arrays = book_arrays
+        self._ladders = {name: prefix for name, prefix in book.LADDERS.items() if name in name_mapping.values()}
+        self._frames = {}  # (date, exchange) -> [pl.DataFrame]
+        self._bytes = {}  # (date, exchange) -> buffered bytes in memory
+        self._written = {}  # date -> [(file name, rows)]
+        self._received = {}  # date -> quotes decoded, before the fused transform filters any row
+        self._count = 0
+
+    def append(self, buffer: bytes) -> int:
+        """decode one ndjson batch, return its date"""
+        # the explicit schema fixes every column dtype, missing keys & empty lists become null & [], no pre-sort needed
+        try:
+            df = pl.read_ndjson(buffer, schema=self._schema)
+        except pl.exceptions.PolarsError as e:
+            chatbot.send_msg(f"read_ndjson parse error, {e}, exiting.")
+            with open("mem_file.json", "wb") as file:
+                file.write(buffer)
+            os._exit(1)  # nonzero, the date is never sealed and the scheduler sees the failure
+        df = df.rename(self._names)
+        if self._ladders and self._book_arrays:
+            df = book.to_arrays(df, self._ladders)
+        elif self._ladders:
+            df = df.with_columns(book.flatten(self._ladders)).drop(list(self._ladders))
+
+        current_date = df.item(0, "date")
+        # one batch answers one get() of one exchange, sh codes start with 5 or 6
+        key = (current_date, "sh" if df.item(0, "code")[0] in "56" else "sz")
+        self._received[current_date] = self._received.get(current_date, 0) + df.height
+        if self._transform is not None:
+            try:
+                df = self._transform(df.lazy()).collect()
+            except pl.exceptions.PolarsError as e:
+                # the batch decoded fine, no ndjson dump, it would point at the wrong step
+                chatbot.send_msg(f"fused transform failed for {current_date}, {e}, exiting.")
+                os._exit(1)
+        self._frames.setdefault(key, []).append(df)
+        self._bytes[key] = self._bytes.get(key, 0) + df.estimated_size()
+        if self._transform is None and self._bytes[key] >= self._target_bytes:
+            self._write(key)
+        return current_date
+
+    def pop_frames(self, current_date: int) -> list[pl.DataFrame]:
+        """buffered frames of current_date, used by the fused mode instead of flush"""
+        keys = [key for key in self._frames if key[0] == current_date]
+        for key in keys:
+            self._bytes.pop(key, None)
+        return [df for key in keys for df in self._frames.pop(key)]
+
+    def flush(self, current_date: int | None = None):
+        """write the buffered frames of current_date, or of every date if None"""
+        for key in [key for key in self._frames if current_date is None or key[0] == current_date]:
+            self._write(key)
+
+    def _write(self, key: tuple[int, str]):
+        frames = self._frames.pop(key, [])
+        self._bytes.pop(key, None)
+        if not frames:
+            return
+        date, exchange = key
+        self._count += 1
+        df = pl.concat(frames)
+        file_name = f"{exchange}_{self._worker_id:02d}_{self._count:06d}.parquet"
+        out_file = f"{self._output_dir}/{date}/{file_name}"
+        os.makedirs(f"{self._output_dir}/{date}", exist_ok=True)
+        # stage under a temp name, a reader globbing *.parquet never sees a truncated chunk
+        df.write_parquet(f"{out_file}.tmp")
+        os.replace(f"{out_file}.tmp", out_file)
+        self._written.setdefault(date, []).append((file_name, df.height))
+
+    def pop_written(self, current_date: int) -> list[tuple[str, int]]:
+        """(file name, rows) written for current_date since the last call"""
+        return self._written.pop(current_date, [])
+
+    def pop_received(self, current_date: int) -> int:
+        """quotes of current_date decoded since the last call"""
+        return self._received.pop(current_date, 0)
+
+
+def is_whole(rows: int, date_totals: dict) -> bool:
+    """the server reported both exchange totals of the date and every quote of them was received"""
+    return all(total is not None for total in date_totals.values()) and rows == sum(date_totals.values())
+
+
+def worker(q: Queue, builder: QuoteBuilder):
+    """parse quote batches from q, each worker owns a builder numbering its own files as {exchange}_{worker_id:02d}_{count:06d}.parquet"""
     hq_logger = logging.getLogger("hq")
     while True:
         quotes = q.get()
-        count += 1
-
-        # sort the quotes by length, long -> short
-        # quotes.sort(key=len, reverse=True)
-        # quotes.sort(key=lambda x: (x.find('],"153":['), x.count('":')), reverse=True)
-        quotes.sort(key=lambda x: x.find('],"153":['), reverse=True)
 
-        with io.BytesIO() as mem_file:
-            for quote in quotes:
-                mem_file.write(quote.encode())
-                mem_file.write(b"\n")
+        # one contiguous ndjson buffer joined from the encoded quotes, no full str copy of the batch, no BytesIO writes
+        buffer = b"\n".join(quote.encode() for quote in quotes)
+        try:
+            current_date = builder.append(buffer)
+        except Exception as e:
+            # e.g. a full disk while writing a chunk, the queue would never drain, so the whole download stops
+            chatbot.send_msg(f"hq worker failed, {e}, exiting.")
+            os._exit(1)
 
-            try:
-                df = pl.read_ndjson(mem_file, schema=schema_mapping).rename(name_mapping)
-            except Exception as e:
-                chatbot.send_msg(f"read_ndjson parse error, {e}, exiting.")
-                with open("mem_file.json", "wb") as file:
-                    file.write(mem_file.getbuffer())
-                os._exit(0)
-
-        current_date = df.item(0, "date")
-        os.makedirs(f"{output_dir}/{current_date}", exist_ok=True)
-        df.write_parquet(f"{output_dir}/{current_date}/{count:08d}.parquet")
         q.task_done()
         hq_logger.debug(f"===>finish {len(quotes)} quotes of {current_date}")
 
 
+def fetch(hq_app: HistoryApp, jobs: Queue, start_time: int, totals: dict):
+    """pull (target_date, line) jobs until none is left, get() and wait() are paired on the connection of hq_app"""
+    while True:
+        try:
+            target_date, line = jobs.get_nowait()
+        except Empty:
+            return
+        hq_app.last_total = None
+        hq_app.get(
+            line=line,
+            startDate=target_date,
+            startTime=start_time,
+            endDate=target_date,
+            endTime=session.END_TIME,
+            rate=-1,  # unsorted
+        )
+        hq_app.wait()
+        totals[(target_date, line[:2])] = hq_app.last_total  # (20240614, "sh") -> 123456
+
+
 def get_codes(secu_type: str) -> tuple:
     """get code line from json file"""
     if secu_type == "etf":
@@ -124,18 +243,39 @@ def get_codes(secu_type: str) -> tuple:
     return sh_codes, sz_codes
 
 
-def download(secu_type: str, quote_type: str, target_dates: list[int]):
+def download(
+    secu_type: str,
+    quote_type: str,
+    target_dates: list[int],
+    num_workers: int = 4,
+    target_mb: int = 128,
+    concurrency: int = 1,
+    fused: bool = False,
+    hot_days: int = 0,
+    indexed: bool = False,
+    compacted: bool = False,
+    book_arrays: bool = False,
+):
     """
     Download the quotes in the target_dates list, where the quotes meet the secu_type and quote_type.\n\n
     Args:
         secu_type: str, example: etf, stock
         quote_type: str, example: kl1m, tick
         target_dates: list[int], example: [20220101, 20220102, ...]
+        num_workers: int, number of parser threads, polars releases the GIL while parsing & writing
+        target_mb: int, in-memory MB buffered per worker, date and exchange before they are coalesced into one parquet file
+        concurrency: int, number of server connections fetching sh & sz of several dates at the same time
+        fused: bool, apply the dt_combiner transform while downloading and write transfer/{secu_type}-{quote_type}/{yyyy}/{date}.ipc directly,
+            a combined day in another layout of hot_days, indexed, compacted and book_arrays is rewritten locally, not downloaded again
+        hot_days: int, in fused mode, days among the last hot_days trading days are written in the uncompressed hot tier
+        indexed: bool, in fused mode, write every day with a code index, see utils.code_index
+        compacted: bool, in fused mode, write every order/trade day delta-encoded in narrow types, see utils.compact
+        book_arrays: bool, tick only, keep every book side as one Array[UInt32, 10] column ap, bp, ..., see utils.book
     """
     chatbot.send_msg(f"begin {secu_type}:{quote_type} from {target_dates[0]} to {target_dates[-1]}")
     hq_logger = get_logger("hq")
 
-    out_dir = f"{secu_type}/{quote_type}"  # etf/tick/
+    out_dir = f"transfer/{secu_type}-{quote_type}" if fused else f"{secu_type}/{quote_type}"  # transfer/etf-tick/ or etf/tick/
     hq_logger.debug(f"output dir: {out_dir}")
 
     if quote_type == "kl1m":
@@ -272,6 +412,10 @@ def download(secu_type: str, quote_type: str, target_dates: list[int]):
         }
     else:
         raise ValueError(f"unknown quote_type: {quote_type}")
+    if compacted and quote_type not in ["order", "trade"]:
+        raise ValueError(f"compacted is for order and trade, not {quote_type}")
+    if book_arrays and quote_type != "tick":
+        raise ValueError(f"book_arrays is for tick, not {quote_type}")
 
     sh_codes, sz_codes = get_codes(secu_type)
     sh_line = f"sh{eq_line}:{sh_codes}"
@@ -279,39 +423,106 @@ def download(secu_type: str, quote_type: str, target_dates: list[int]):
     sz_line = f"sz{eq_line}:{sz_codes}"
     hq_logger.debug(f"quote line: {sz_line}")
 
-    start_time = 91500000 if quote_type in ["order", "trade"] else 92500000
-
-    q = Queue(maxsize=qsize)
-    hq_app = HistoryApp(q)
-    threading.Thread(target=worker, args=(q, schema, name_mapping, out_dir), daemon=True).start()
-    hq_app.start()
+    start_time = session.AUCTION_OPEN_TIME if quote_type in ["order", "trade"] else session.AUCTION_MATCH_TIME
 
+    # resume: skip the dates sealed by a complete manifest, redo the partial ones from scratch
+    hot_dates = tier.hot_dates(hot_days) if fused else set()
+    pending_dates = []
     for target_date in target_dates:
-        hq_logger.debug(f"hq_app begin {target_date}")
-        # sh
-        hq_app.get(
-            line=sh_line,
-            startDate=target_date,
-            startTime=start_time,
-            endDate=target_date,
-            endTime=150100000,
-            rate=-1,  # unsorted
-        )
-        hq_app.wait()
-        # sz
-        hq_app.get(
-            line=sz_line,
-            startDate=target_date,
-            startTime=start_time,
-            endDate=target_date,
-            endTime=150100000,
-            rate=-1,  # unsorted
-        )
-        hq_app.wait()
-        hq_logger.info(f"hq_app downloaded {target_date}")
-    q.join()
+        if fused:
+            # the day file is written through a temp file and rename, existing means complete, but it may be in another layout
+            day_file = dt_combiner.day_file(out_dir, target_date)
+            layout = deps.day_layout(target_date in hot_dates, indexed, compacted, book_arrays)
+            if deps.has_layout(day_file, layout):
+                hq_logger.info(f"skip {target_date}, already combined")
+                continue
+            if os.path.exists(day_file):
+                # the rows are all there, only the layout changed, no need to download the day again
+                try:
+                    dt_combiner.rewrite_day(quote_type, target_date, out_dir, target_date in hot_dates, indexed, compacted, book_arrays)
+                    hq_logger.info(f"rewrote {target_date} in the layout {layout}")
+                    continue
+                except (OSError, pl.exceptions.PolarsError) as e:
+                    hq_logger.warning(f"redo {target_date}, rewriting it in the layout {layout} failed, {e}")
+            pending_dates.append(target_date)
+            continue
+        date_dir = f"{out_dir}/{target_date}"
+        if manifest.is_complete(date_dir):
+            hq_logger.info(f"skip {target_date}, already downloaded")
+            continue
+        if os.path.exists(date_dir):
+            hq_logger.info(f"redo {target_date}, remove partial {date_dir}")
+            shutil.rmtree(date_dir)
+        pending_dates.append(target_date)
+
+    q = Queue(maxsize=qsize)
+    get_logger("eq", fmt="%(asctime)s - %(message)s")
+    hq_apps = [HistoryApp(q) for _ in range(concurrency)]
+    transform = dt_combiner.get_transform(quote_type, book_arrays) if fused else None
+    builders = [QuoteBuilder(worker_id, schema, name_mapping, out_dir, target_mb, transform, book_arrays) for worker_id in range(num_workers)]
+    for builder in builders:
+        threading.Thread(target=worker, args=(q, builder), daemon=True).start()
+    for hq_app in hq_apps:
+        hq_app.start()
+
+    # sh & sz of (concurrency + 1) // 2 dates are fetched together, one job per connection at a time
+    wave_size = (concurrency + 1) // 2
+    totals = {}
+    for i in range(0, len(pending_dates), wave_size):
+        wave_dates = pending_dates[i : i + wave_size]
+        hq_logger.debug(f"hq_app begin {wave_dates}")
+        jobs = Queue()
+        for target_date in wave_dates:
+            jobs.put((target_date, sh_line))
+            jobs.put((target_date, sz_line))
+        fetchers = [threading.Thread(target=fetch, args=(hq_app, jobs, start_time, totals)) for hq_app in hq_apps]
+        for fetcher in fetchers:
+            fetcher.start()
+        for fetcher in fetchers:
+            fetcher.join()
+        # workers are idle once the queue is drained, flush the tail of the dates
+        q.join()
+        for target_date in wave_dates:
+            # a date is sealed only if the server totals of sh & sz arrived and match, a disconnect leaves it for the next run
+            date_totals = {"sh": totals.get((target_date, "sh")), "sz": totals.get((target_date, "sz"))}
+            received = sum(builder.pop_received(target_date) for builder in builders)
+            if fused:
+                frames = [df for builder in builders for df in builder.pop_frames(target_date)]
+                if not is_whole(received, date_totals):
+                    hq_logger.warning(f"{target_date} received {received} quotes, server totals {date_totals}, not combined")
+                    continue
+                if frames:
+                    df = pl.concat(frames).sort(dt_combiner.SORT_KEYS[quote_type])
+                    dt_combiner.check_nulls(quote_type, df.null_count(), f"{secu_type}:{quote_type}:{target_date}")
+                    dt_combiner.write_day(df, out_dir, target_date, target_date in hot_dates, indexed, compacted)
+                    # no chunk is kept, only the layout is recorded, dt_combiner rebuilds the day if chunks are downloaded later
+                    deps.record(dt_combiner.day_file(out_dir, target_date), [], deps.day_layout(target_date in hot_dates, indexed, compacted, book_arrays))
+                hq_logger.info(f"hq_app downloaded & combined {target_date}, {sum(df.height for df in frames)} rows")
+                continue
+            written = []
+            for builder in builders:
+                builder.flush(target_date)
+                written += builder.pop_written(target_date)
+            rows = sum(file_rows for _, file_rows in written)
+            complete = is_whole(rows, date_totals)
+            if not complete:
+                hq_logger.warning(f"{target_date} wrote {rows} rows, server totals {date_totals}, not sealed")
+            manifest.write_manifest(
+                f"{out_dir}/{target_date}",
+                {
+                    "date": target_date,
+                    "complete": complete,
+                    "totals": date_totals,
+                    "rows": rows,
+                    "files": sorted(file_name for file_name, _ in written),
+                },
+            )
+            if not complete:
+                continue
+            hq_logger.info(f"hq_app downloaded {target_date}")
     hq_logger.debug(f"worker finish processing {target_dates[0]}~{target_dates[-1]}")
-    hq_app.stop()
+    for hq_app in hq_apps:
+        hq_app.stop()
     hq_logger.info("hq_app disconnect from server.")
     chatbot.send_msg(f"finish {secu_type}:{quote_type} from {target_dates[0]} to {target_dates[-1]}")
 
@@ -328,7 +539,7 @@ def get_target_dates(date_start: int, date_end: int) -> list[int]:
 
 def process(args):
     target_dates = get_target_dates(args.date_start, args.date_end)
-    download(args.secu_type, args.quote_type, target_dates)
+    download(args.secu_type, args.quote_type, target_dates, args.num_workers, args.target_mb, args.concurrency, args.fused, args.hot_days, args.indexed, args.compacted, args.book_arrays)
 
 
 if __name__ == "__main__":
@@ -337,6 +548,14 @@ if __name__ == "__main__":
     parser.add_argument("-dte", type=int, required=True, dest="date_end", help="end date, 20241231")
     parser.add_argument("-st", type=str, required=True, dest="secu_type", choices=["stock", "etf"], help="security type")
     parser.add_argument("-qt", type=str, required=True, dest="quote_type", choices=["tick", "kl1m", "trade", "order"], help="quote type")
+    parser.add_argument("-nw", type=int, dest="num_workers", default=4, help="number of parser workers, default 4")
+    parser.add_argument("-tm", type=int, dest="target_mb", default=128, help="in-memory MB coalesced into one parquet file, default 128")
+    parser.add_argument("-fused", dest="fused", action="store_true", help="flag, combine while downloading, write transfer/*.ipc without intermediate parquet")
+    parser.add_argument("-cc", type=int, dest="concurrency", default=1, help="number of concurrent server connections, 2 fetches sh & sz together")
+    parser.add_argument("-hot", type=int, dest="hot_days", default=0, help="with -fused, write the days among the last N trading days uncompressed, 0 means none")
+    parser.add_argument("-index", dest="indexed", action="store_true", help="flag, with -fused, write one record batch per code and a code index sidecar")
+    parser.add_argument("-compact", dest="compacted", action="store_true", help="flag, with -fused, order/trade only, delta-encode seq_no and dt in narrow types")
+    parser.add_argument("-book_array", dest="book_arrays", action="store_true", help="flag, tick only, keep the books as Array[UInt32, 10] columns ap, bp, ... instead of 60 level columns")
 
     args = parser.parse_args()
     process(args)
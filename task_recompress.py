@@ -0,0 +1,27 @@
+import argparse
+from utils import chatbot, tier
+
+
+def job_worker(root: str, hot_days: int):
+    results = tier.recompress(root, hot_days)
+    kept = {ipc_file: reason for ipc_file, reason in results.items() if reason != "ok"}
+    summary = f"recompress {root}: {len(results) - len(kept)} aged out of the hot tier, {len(kept)} kept hot"
+    if kept:
+        summary += ": " + "; ".join(f"{ipc_file} {reason}" for ipc_file, reason in kept.items())
+    chatbot.send_msg(summary)
+
+
+# run at 23:30 every day, after daily_etf, with the same -hot N as the writers
+
+
+def process(args):
+    job_worker(args.root, args.hot_days)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="recompress the hot ipc files that aged out of the last N trading days to zstd")
+    parser.add_argument("-hot", type=int, required=True, dest="hot_days", help="number of recent trading days kept hot")
+    parser.add_argument("-root", type=str, dest="root", default="transfer", help="root of the {secu}-{qt}/{yyyy}/{date}.ipc files, default transfer")
+
+    args = parser.parse_args()
+    process(args)
@@ -0,0 +1,49 @@
+import argparse
+import numpy as np
+import polars as pl
+from utils import book
+from bench_util import timeit, work_dir
+
+
+def synthesize_books(num_rows: int) -> pl.DataFrame:
+    """the six full 10-level list columns of a tick batch as decoded by hq.QuoteBuilder"""
+    rng = np.random.default_rng(0)
+    return pl.DataFrame({name: pl.Series(name, rng.integers(0, 10**6, (num_rows, book.LEVELS)).tolist(), dtype=pl.List(pl.Int64)) for name in book.LADDERS})
+
+
+def bench(name: str, func, repeat: int):
+    elapsed, _ = timeit(func, repeat)
+    print(f"{name:<32} {elapsed * 1000:10.1f} ms")
+
+
+def process(args):
+    with work_dir("bench_book_") as tmp_dir:
+        df = synthesize_books(args.num_rows)
+        bench("ingest flatten, 60 columns", lambda: df.with_columns(book.flatten()).drop(list(book.LADDERS)), args.repeat)
+        bench("ingest to_arrays, 6 columns", lambda: book.to_arrays(df), args.repeat)
+
+        flat_file, array_file = f"{tmp_dir}/flat.ipc", f"{tmp_dir}/array.ipc"
+        df.with_columns(book.flatten()).drop(list(book.LADDERS)).write_ipc(flat_file, compression="zstd")
+        book.to_arrays(df).write_ipc(array_file, compression="zstd")
+
+        def depth(ipc_file: str, columns: list[str]) -> np.ndarray:
+            """total ask volume of the 10 levels, one row per tick"""
+            return book.ladder(pl.read_ipc(ipc_file, columns=columns, memory_map=False), "av").sum(axis=1)
+
+        flat_columns = [f"av{i}" for i in range(book.LEVELS)]
+        bench("depth from av0..av9", lambda: depth(flat_file, flat_columns), args.repeat)
+        bench("depth from av array", lambda: depth(array_file, ["av"]), args.repeat)
+        assert np.array_equal(depth(flat_file, flat_columns), depth(array_file, ["av"]))
+
+        df_flat, df_array = pl.read_ipc(flat_file, memory_map=False), pl.read_ipc(array_file, memory_map=False)
+        bench("ladder of av0..av9 in memory", lambda: book.ladder(df_flat, "av"), args.repeat)
+        bench("ladder of av array in memory", lambda: book.ladder(df_array, "av"), args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the book as 60 level columns vs 6 Array columns, run from repo root: PYTHONPATH=. python test/bench_book.py")
+    parser.add_argument("-n", type=int, dest="num_rows", default=1_000_000, help="ticks")
+    parser.add_argument("-r", type=int, dest="repeat", default=5, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
@@ -0,0 +1,63 @@
+import re
+import glob
+import json
+import argparse
+import polars as pl
+import hq
+from bench_util import TICK_NAME_MAPPING, TICK_SCHEMA, timeit, work_dir
+
+
+def synthesize_batches(sample_file: str, num_batches: int, batch_quotes: int) -> list[bytes]:
+    """ndjson buffers like hq.worker hands to QuoteBuilder.append, every batch of one code, slices of the sample"""
+    with open(sample_file) as file:
+        quotes = json.load(file)
+    batches = []
+    for i in range(num_batches):
+        start = i * batch_quotes % len(quotes)
+        buffer = "\n".join(quotes[start : start + batch_quotes])
+        batches.append(re.sub(r'"0":"\d{6}"', f'"0":"{510000 + i % 500}"', buffer).encode())
+    return batches
+
+
+def build(batches: list[bytes], out_dir: str, target_mb: int) -> int:
+    """feed the batches to one hq.QuoteBuilder and flush it, target_mb 0 writes one parquet per batch, return the files written"""
+    builder = hq.QuoteBuilder(0, TICK_SCHEMA, TICK_NAME_MAPPING, out_dir, target_mb)
+    dates = {builder.append(buffer) for buffer in batches}
+    builder.flush()
+    return sum(len(builder.pop_written(current_date)) for current_date in dates)
+
+
+def bench_build(name: str, batches: list[bytes], out_dir: str, target_mb: int, repeat: int):
+    """a fresh builder numbers its files from 1 again, every call rewrites the same files"""
+    elapsed, num_files = timeit(lambda: build(batches, out_dir, target_mb), repeat)
+    print(f"{name:<10} build {num_files:6d} files {elapsed * 1000:10.1f} ms")
+
+
+def bench_scan(name: str, out_dir: str, repeat: int):
+    """the scan pattern of dt_combiner.combine_tick"""
+    num_files = len(glob.glob(f"{out_dir}/*/*.parquet"))
+    lf = pl.scan_parquet(f"{out_dir}/*/*.parquet").filter(pl.col("last") != 0).select("code", "date", "time", "last", "ap0", "bv9")
+    elapsed, df = timeit(lf.collect, repeat)
+    print(f"{name:<10} scan  {num_files:6d} files {df.height:10d} rows {elapsed * 1000:10.1f} ms")
+
+
+def process(args):
+    batches = synthesize_batches(args.sample_file, args.num_batches, args.batch_quotes)
+    with work_dir("bench_coalesce_") as tmp_dir:
+        bench_build("chunks", batches, f"{tmp_dir}/chunks", 0, args.repeat)
+        bench_build("coalesced", batches, f"{tmp_dir}/coalesced", args.target_mb, args.repeat)
+
+        bench_scan("chunks", f"{tmp_dir}/chunks", args.repeat)
+        bench_scan("coalesced", f"{tmp_dir}/coalesced", args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark hq.QuoteBuilder writing a parquet per batch vs coalesced files, and the combiner scan of both, run from repo root: PYTHONPATH=. python test/bench_coalesce.py")
+    parser.add_argument("-f", type=str, dest="sample_file", default="samples/etf_tick.json", help="json list of quotes to synthesize batches")
+    parser.add_argument("-n", type=int, dest="num_batches", default=2000, help="number of synthesized batches")
+    parser.add_argument("-b", type=int, dest="batch_quotes", default=100, help="quotes per synthesized batch")
+    parser.add_argument("-tm", type=int, dest="target_mb", default=128, help="target in-memory MB per coalesced file")
+    parser.add_argument("-r", type=int, dest="repeat", default=3, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
@@ -0,0 +1,46 @@
+import argparse
+import numpy as np
+import polars as pl
+from utils import code_index
+from bench_util import timeit, work_dir
+
+
+def synthesize_day(num_rows: int, num_codes: int, num_columns: int) -> pl.DataFrame:
+    """a tick-like day sorted by [code, dt], random values so zstd has real work to do"""
+    rng = np.random.default_rng(0)
+    columns = {
+        "code": np.sort(rng.integers(0, num_codes, num_rows)).astype(np.uint32) + 510000,
+        "dt": (np.datetime64("2024-06-14") + rng.integers(9 * 3600000, 15 * 3600000, num_rows).astype("timedelta64[ms]")),
+    }
+    for i in range(num_columns):
+        columns[f"c{i}"] = rng.integers(0, 10000, num_rows).astype(np.uint32)
+    return pl.DataFrame(columns).sort("code", "dt")
+
+
+def bench(name: str, func, repeat: int):
+    elapsed, df = timeit(func, repeat)
+    print(f"{name:<24} {df.height:8d} rows {elapsed * 1000:10.1f} ms")
+
+
+def process(args):
+    with work_dir("bench_code_index_") as tmp_dir:
+        df = synthesize_day(args.num_rows, args.num_codes, args.num_columns)
+        plain_file, indexed_file = f"{tmp_dir}/plain.ipc", f"{tmp_dir}/indexed.ipc"
+        df.write_ipc(plain_file, compression="zstd")
+        code_index.by_code(df).write_ipc(indexed_file, compression="zstd")
+        code_index.write(df.lazy(), indexed_file)
+        code = int(df["code"][df.height // 2])
+
+        bench("filter code", lambda: pl.scan_ipc(plain_file, memory_map=False).filter(pl.col("code") == code).collect(), args.repeat)
+        bench("code index", lambda: code_index.read(indexed_file, [code]).collect(), args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark one code of a day, filter vs code index, run from repo root: PYTHONPATH=. python test/bench_code_index.py")
+    parser.add_argument("-n", type=int, dest="num_rows", default=3_000_000, help="rows of the day")
+    parser.add_argument("-c", type=int, dest="num_codes", default=1500, help="codes of the day")
+    parser.add_argument("-w", type=int, dest="num_columns", default=60, help="value columns")
+    parser.add_argument("-r", type=int, dest="repeat", default=5, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
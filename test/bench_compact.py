@@ -0,0 +1,62 @@
+import os
+import argparse
+import numpy as np
+import polars as pl
+from utils import compact
+from bench_util import timeit, work_dir
+
+
+def synthesize_day(num_rows: int, num_codes: int) -> pl.DataFrame:
+    """an order-like day sorted by [code, dt], seq_no rising through the day like the exchange channel sequence"""
+    rng = np.random.default_rng(0)
+    ms = np.sort(rng.integers(9 * 3600000 + 15 * 60000, 15 * 3600000, num_rows))
+    seq_no = np.arange(num_rows, dtype=np.uint64) * 3 + 100000
+    df = pl.DataFrame(
+        {
+            "code": rng.integers(0, num_codes, num_rows).astype(np.uint32),
+            "dt": np.datetime64("2024-06-14") + ms.astype("timedelta64[ms]"),
+            "seq_no": seq_no,
+            "price": rng.integers(1000, 100000, num_rows).astype(np.uint32),
+            "volume": (rng.integers(1, 100, num_rows) * 100).astype(np.uint64),
+            "bs_flag": rng.integers(1, 3, num_rows).astype(np.uint8),
+            "order_type": rng.integers(1, 3, num_rows).astype(np.uint8),
+            "orgin_seq_no": (seq_no // 2 + rng.integers(0, 1000, num_rows).astype(np.uint64)),
+        }
+    )
+    return df.sort("code", "dt")
+
+
+def bench(name: str, func, repeat: int):
+    elapsed, df = timeit(func, repeat)
+    print(f"{name:<24} {df.height:8d} rows {elapsed * 1000:10.1f} ms")
+    return df
+
+
+def process(args):
+    with work_dir("bench_compact_") as tmp_dir:
+        df = pl.read_ipc(args.in_file, memory_map=False) if args.in_file else synthesize_day(args.num_rows, args.num_codes)
+        plain_file, compact_file = f"{tmp_dir}/plain.ipc", f"{tmp_dir}/compact.ipc"
+        df.write_ipc(plain_file, compression="zstd")
+        df_compact, manifest = compact.encode(df)
+        df_compact.write_ipc(compact_file, compression="zstd")
+        compact.write_manifest(manifest, compact_file)
+
+        plain_bytes, compact_bytes = os.path.getsize(plain_file), os.path.getsize(compact_file)
+        print(f"zstd {plain_bytes / 1024**2:.2f} MB, compact + zstd {compact_bytes / 1024**2:.2f} MB, ratio {plain_bytes / compact_bytes:.3f}")
+        for name, column in manifest.items():
+            print(f"  {name:<14} {column['dtype']:<10} -> {column['stored']:<8} {'delta' if column['delta'] else ''}")
+
+        bench("read zstd", lambda: pl.read_ipc(plain_file, memory_map=False), args.repeat)
+        df_decoded = bench("read compact + decode", lambda: compact.decode(pl.scan_ipc(compact_file, memory_map=False), compact_file).collect(), args.repeat)
+        assert df_decoded.equals(df), "compact round trip differs"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the compact encoding of an order/trade day against plain zstd, run from repo root: PYTHONPATH=. python test/bench_compact.py")
+    parser.add_argument("-i", type=str, dest="in_file", default="", help="a combined order/trade day, e.g. transfer/stock-order/2024/20240614.ipc, synthetic if empty")
+    parser.add_argument("-n", type=int, dest="num_rows", default=5_000_000, help="rows of the synthetic day")
+    parser.add_argument("-c", type=int, dest="num_codes", default=2000, help="codes of the synthetic day")
+    parser.add_argument("-r", type=int, dest="repeat", default=5, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
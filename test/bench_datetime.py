@@ -0,0 +1,36 @@
+import argparse
+import numpy as np
+import polars as pl
+from utils import timestamp
+from bench_util import timeit
+
+
+def gen_frame(rows: int) -> pl.DataFrame:
+    """date & time columns like the downloaded chunks, one trading day of 3s ticks repeated"""
+    rng = np.random.default_rng(0)
+    seconds = rng.integers(9 * 3600 + 1500, 15 * 3600, rows)
+    times = seconds // 3600 * 10_000_000 + seconds // 60 % 60 * 100_000 + seconds % 60 * 1000 + rng.integers(0, 1000, rows)
+    return pl.DataFrame({"date": np.full(rows, 20240614, dtype=np.int32), "time": times.astype(np.int32)})
+
+
+def bench(name: str, df: pl.DataFrame, expr: pl.Expr, repeat: int) -> pl.DataFrame:
+    elapsed, out = timeit(lambda: df.select(expr), repeat)
+    print(f"{name:<10} {elapsed * 1000:10.1f} ms {df.height / elapsed / 1e6:10.1f} M rows/s")
+    return out
+
+
+def process(args):
+    df = gen_frame(args.rows)
+    strptime = (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt")
+    out_str = bench("strptime", df, strptime, args.repeat)
+    out_int = bench("integer", df, timestamp.to_datetime("date", "time").alias("dt"), args.repeat)
+    print("identical:", out_str.equals(out_int))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark dt construction of dt_combiner, run from repo root: PYTHONPATH=. python test/bench_datetime.py")
+    parser.add_argument("-n", type=int, dest="rows", default=10_000_000, help="number of rows")
+    parser.add_argument("-r", type=int, dest="repeat", default=3, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
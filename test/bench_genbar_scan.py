@@ -0,0 +1,39 @@
+import argparse
+import polars as pl
+import genbar
+from bench_util import timeit, work_dir
+
+
+def bench(name: str, in_file: str, columns: list[str] | None, memory_map: bool, repeat: int):
+    """scan of one tick day, all columns like the old read_ipc, or the projection of genbar.gen_bar1m_days"""
+    lf = pl.scan_ipc(in_file, memory_map=memory_map)
+    if columns is not None:
+        lf = lf.select(columns)
+    elapsed, df = timeit(lf.collect, repeat)
+    print(f"{name:<32} {df.width:3d} columns {elapsed * 1000:10.1f} ms")
+
+
+def process(args):
+    with work_dir("bench_genbar_scan_") as tmp_dir:
+        df = pl.read_ipc(args.in_file, memory_map=False)
+        if args.scale > 1:
+            # more codes, like a stock day
+            df = pl.concat([df.with_columns(pl.col("code") + i * 1000000) for i in range(args.scale)])
+        print(f"{df.height} rows, {df.estimated_size() / 1e6:.0f} MB in memory")
+
+        for compression in ["zstd", "uncompressed"]:
+            in_file = f"{tmp_dir}/{compression}.ipc"
+            df.write_ipc(in_file, compression=compression)
+            bench(f"{compression} all", in_file, None, False, args.repeat)
+            bench(f"{compression} projected", in_file, genbar.BAR1M_TICK_COLUMNS, False, args.repeat)
+            bench(f"{compression} projected mmap", in_file, genbar.BAR1M_TICK_COLUMNS, True, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark genbar tick scans, all columns vs projected, run from repo root: PYTHONPATH=. python test/bench_genbar_scan.py -i ...")
+    parser.add_argument("-i", type=str, required=True, dest="in_file", help="a tick day, e.g. transfer/etf-tick/2024/20240614.ipc")
+    parser.add_argument("-s", type=int, dest="scale", default=1, help="repeat the codes s times to enlarge the day")
+    parser.add_argument("-r", type=int, dest="repeat", default=5, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
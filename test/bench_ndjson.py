@@ -0,0 +1,55 @@
+import io
+import json
+import argparse
+import polars as pl
+from bench_util import TICK_SCHEMA, timeit
+
+
+def assemble_bytesio(quotes: list[str]) -> io.BytesIO:
+    """old hq.worker path: encode every quote and write it into a BytesIO"""
+    mem_file = io.BytesIO()
+    for quote in quotes:
+        mem_file.write(quote.encode())
+        mem_file.write(b"\n")
+    return mem_file
+
+
+def assemble_joined(quotes: list[str]) -> bytes:
+    """one newline-joined str, then encoded, the whole batch is copied twice"""
+    return "\n".join(quotes).encode()
+
+
+def assemble_encoded(quotes: list[str]) -> bytes:
+    """hq.worker path: every quote encoded, then joined as bytes, no full str copy of the batch"""
+    return b"\n".join(quote.encode() for quote in quotes)
+
+
+def bench(name: str, func, quotes: list[str], nbytes: int, repeat: int):
+    elapsed, _ = timeit(lambda: func(quotes), repeat)
+    print(f"{name:<24} {elapsed * 1000:8.3f} ms {nbytes / elapsed / 1e6:10.1f} MB/s")
+
+
+def process(args):
+    with open(args.sample_file) as file:
+        quotes = json.load(file)  # list of onQuote strings
+    # copy the strings, so json.load's memo does not hand out shared objects
+    quotes = [quote + "" for quote in quotes] * args.scale
+    nbytes = len(assemble_joined(quotes))
+    print(f"{len(quotes)} quotes, {nbytes / 1e6:.2f} MB per batch")
+
+    bench("assemble bytesio", assemble_bytesio, quotes, nbytes, args.repeat)
+    bench("assemble joined", assemble_joined, quotes, nbytes, args.repeat)
+    bench("assemble encoded", assemble_encoded, quotes, nbytes, args.repeat)
+    bench("assemble+parse bytesio", lambda x: pl.read_ndjson(assemble_bytesio(x), schema=TICK_SCHEMA), quotes, nbytes, args.repeat)
+    bench("assemble+parse joined", lambda x: pl.read_ndjson(assemble_joined(x), schema=TICK_SCHEMA), quotes, nbytes, args.repeat)
+    bench("assemble+parse encoded", lambda x: pl.read_ndjson(assemble_encoded(x), schema=TICK_SCHEMA), quotes, nbytes, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark ndjson batch assembly of hq.worker")
+    parser.add_argument("-f", type=str, dest="sample_file", default="samples/etf_tick.json", help="json list of quotes")
+    parser.add_argument("-s", type=int, dest="scale", default=1, help="repeat the sample s times to enlarge one batch")
+    parser.add_argument("-r", type=int, dest="repeat", default=50, help="repeat times")
+
+    args = parser.parse_args()
+    process(args)
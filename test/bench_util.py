@@ -0,0 +1,60 @@
+import time
+import shutil
+import tempfile
+import contextlib
+import polars as pl
+
+# the tick fields of samples/etf_tick.json read by the benchmarks, a subset of the tick schema of hq.download
+TICK_SCHEMA = {
+    "0": pl.Utf8,
+    "3": pl.Int32,
+    "4": pl.Int32,
+    "100": pl.Int32,
+    "101": pl.Int32,
+    "104": pl.Int32,
+    "108": pl.List(pl.Int32),
+    "109": pl.List(pl.Int32),
+    "110": pl.List(pl.Int32),
+    "111": pl.List(pl.Int32),
+    "112": pl.Int32,
+    "113": pl.Int64,
+    "114": pl.Int64,
+    "151": pl.List(pl.Int32),
+    "153": pl.List(pl.Int32),
+}
+TICK_NAME_MAPPING = {
+    "0": "code",
+    "3": "date",
+    "4": "time",
+    "100": "preclose",
+    "101": "open",
+    "104": "last",
+    "108": "ask_prices",
+    "109": "ask_volumes",
+    "110": "bid_prices",
+    "111": "bid_volumes",
+    "112": "num_trades",
+    "113": "volume",
+    "114": "amount",
+    "151": "bid_nums",
+    "153": "ask_nums",
+}
+
+
+def timeit(func, repeat: int):
+    """mean seconds of func() over repeat calls after one warm-up call, and the result of the last call"""
+    result = func()  # warm up, also the page cache of the files func reads
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+@contextlib.contextmanager
+def work_dir(prefix: str):
+    """a temp dir for the files of a benchmark, removed afterwards even if it fails"""
+    path = tempfile.mkdtemp(prefix=prefix)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
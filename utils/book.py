@@ -0,0 +1,65 @@
+import numpy as np
+import polars as pl
+
+LEVELS = 10
+ARRAY = pl.Array(pl.UInt32, LEVELS)  # one book side as a fixed-size list, level 0 first
+# list column of hq.download -> prefix of its flattened level columns, also the name of its Array column
+LADDERS = {
+    "ask_prices": "ap",
+    "bid_prices": "bp",
+    "ask_volumes": "av",
+    "bid_volumes": "bv",
+    "ask_nums": "an",
+    "bid_nums": "bn",
+}
+
+
+def flatten(ladders: dict = LADDERS) -> list[pl.Expr]:
+    """explode the 10-level list columns into ap0..ap9, bp0..bp9, ... as UInt32, missing levels are 0"""
+    return [pl.col(name).list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0).alias(f"{prefix}{i}") for name, prefix in ladders.items() for i in range(LEVELS)]
+
+
+def stack(ladders: dict = LADDERS) -> list[pl.Expr]:
+    """the 10-level list columns as ARRAY columns ap, bp, ..., level by level like flatten, missing levels are 0"""
+    return [pl.concat_arr([pl.col(name).list.get(i, null_on_oob=True).cast(pl.UInt32).fill_null(0) for i in range(LEVELS)]).alias(prefix) for name, prefix in ladders.items()]
+
+
+def to_arrays(df: pl.DataFrame, ladders: dict = LADDERS) -> pl.DataFrame:
+    """
+    Replace the 10-level list columns of df by ARRAY columns ap, bp, ...\n\n
+    A side whose books are all full is converted by a single cast, about 4x faster than flatten,
+    a side with a short, empty or null book goes through stack.
+    """
+    full = df.select(
+        [((pl.col(name).list.len() == LEVELS).all(ignore_nulls=False) & (pl.col(name).explode().null_count() == 0)).alias(name) for name in ladders]
+    ).row(0, named=True)
+    return df.with_columns([pl.col(name).cast(ARRAY).alias(prefix) if full[name] else stack({name: prefix})[0] for name, prefix in ladders.items()]).drop(list(ladders))
+
+
+def level_columns(names: list[str], ladders: dict = LADDERS) -> list[pl.Expr]:
+    """level columns of a tick chunk, flatten the list columns, or pick the ones already flattened by hq.QuoteBuilder, or split its ARRAY columns"""
+    if all(name in names for name in ladders):
+        return flatten(ladders)
+    if all(prefix in names for prefix in ladders.values()):
+        return [pl.col(prefix).arr.get(i).alias(f"{prefix}{i}") for prefix in ladders.values() for i in range(LEVELS)]
+    return [pl.col(f"{prefix}{i}") for prefix in ladders.values() for i in range(LEVELS)]
+
+
+def array_columns(names: list[str], ladders: dict = LADDERS) -> list[pl.Expr]:
+    """ARRAY columns of a tick chunk, stack the list columns, or pick the ones already converted by hq.QuoteBuilder, or gather its level columns"""
+    if all(name in names for name in ladders):
+        return stack(ladders)
+    if all(prefix in names for prefix in ladders.values()):
+        return [pl.col(prefix).cast(ARRAY) for prefix in ladders.values()]
+    return [pl.concat_arr([pl.col(f"{prefix}{i}") for i in range(LEVELS)]).cast(ARRAY).alias(prefix) for prefix in ladders.values()]
+
+
+def ladder(df: pl.DataFrame, prefix: str) -> np.ndarray:
+    """
+    One book side of df as a (rows, LEVELS) NumPy array, e.g. ladder(df, "ap")[:, 0] is the best ask.\n\n
+    A view without copy of an ARRAY column in one chunk without nulls (rechunk a frame concatenated from several days first),
+    a copy stacked from ap0..ap9 for the flattened layout.
+    """
+    if prefix in df.columns:
+        return df[prefix].to_numpy()
+    return df.select([f"{prefix}{i}" for i in range(LEVELS)]).to_numpy()
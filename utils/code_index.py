@@ -0,0 +1,117 @@
+import os
+import glob
+import json
+import datetime as dt
+import polars as pl
+from utils import compact, manifest, tier
+from utils.timestamp import MS_PER_DAY
+
+
+def index_file(ipc_file: str) -> str:
+    return f"{ipc_file}.index.json"  # transfer/etf-tick/2022/20220104.ipc.index.json
+
+
+def by_code(df: pl.DataFrame) -> pl.DataFrame:
+    """df sorted by [code, dt] as one chunk per code, write_ipc writes every chunk as its own record batch"""
+    return pl.concat(df.partition_by("code", maintain_order=True), rechunk=False) if df.height else df
+
+
+def write_parts(parts, ipc_file: str, compression: str):
+    """
+    write the frames of parts, each sorted by [code, dt] and in code order, into one ipc file as one record batch per code,
+    only one part is in memory at a time, for the days combined by code range
+    """
+    import pyarrow as pa  # polars cannot append record batches to an ipc file, only the spilled indexed days need pyarrow
+
+    options = pa.ipc.IpcWriteOptions(compression=None if compression == "uncompressed" else compression)
+    writer = None
+    try:
+        for df in parts:
+            table = by_code(df).to_arrow()  # a polars chunk becomes an arrow record batch
+            if writer is None:
+                writer = pa.ipc.new_file(ipc_file, table.schema, options=options)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def build(lf: pl.LazyFrame) -> dict:
+    """code -> [row offset, rows, min dt, max dt] of a frame sorted by code, dt in ms since epoch"""
+    df = (
+        lf.group_by("code", maintain_order=True)
+        .agg(pl.len().alias("rows"), pl.col("dt").min().cast(pl.Int64).alias("min_dt"), pl.col("dt").max().cast(pl.Int64).alias("max_dt"))
+        .with_columns((pl.col("rows").cum_sum() - pl.col("rows")).alias("offset"))
+        .collect()
+    )
+    return {str(code): [offset, rows, min_dt, max_dt] for code, rows, min_dt, max_dt, offset in df.iter_rows()}
+
+
+def write(lf: pl.LazyFrame, ipc_file: str):
+    """write the sidecar index of ipc_file, lf is the content of ipc_file"""
+    manifest.write_json(index_file(ipc_file), build(lf.select("code", "dt")))
+
+
+def remove(ipc_file: str):
+    """drop the index of a rewritten ipc_file, a stale index would slice the wrong rows"""
+    if os.path.exists(index_file(ipc_file)):
+        os.remove(index_file(ipc_file))
+
+
+def _ms_of_day(time: dt.time) -> int:
+    return ((time.hour * 60 + time.minute) * 60 + time.second) * 1000 + time.microsecond // 1000
+
+
+def read(ipc_file: str, codes: list[int], start_time: dt.time | None = None, end_time: dt.time | None = None, columns: list[str] | None = None) -> pl.LazyFrame:
+    """
+    Rows of codes within [start_time, end_time] of one day file.\n\n
+    With the index, only the record batches of the codes whose [min dt, max dt] overlaps the time range are read,
+    without it, the whole file is scanned and filtered. A compact day is decoded after the codes are selected, see utils.compact.
+    Args:
+        codes: list[int], e.g. [510050, 510300]
+        columns: list[str], columns to read, None means all
+    """
+    start_ms = _ms_of_day(start_time) if start_time else 0
+    end_ms = _ms_of_day(end_time) if end_time else MS_PER_DAY - 1
+    lf = tier.scan_ipc([ipc_file])
+    if os.path.exists(index_file(ipc_file)):
+        with open(index_file(ipc_file), "r") as file:
+            index = json.load(file)
+        # in file order, the rows stay sorted by [code, dt] whatever the order of codes
+        slices = sorted(
+            (offset, rows)
+            for offset, rows, min_dt, max_dt in [index[str(int(code))] for code in set(codes) if str(int(code)) in index]
+            if min_dt % MS_PER_DAY <= end_ms and max_dt % MS_PER_DAY >= start_ms
+        )
+        lf = pl.concat([lf.slice(offset, rows) for offset, rows in slices]) if slices else lf.clear()
+    else:
+        lf = lf.filter(pl.col("code").is_in([int(code) for code in codes]))
+    lf = compact.decode(lf, ipc_file)
+
+    if start_time or end_time:
+        lf = lf.filter((pl.col("dt").cast(pl.Int64) % MS_PER_DAY).is_between(start_ms, end_ms))
+    return lf.select(columns) if columns else lf
+
+
+def read_days(
+    in_dir: str,
+    codes: list[int],
+    start_date: int,
+    end_date: int,
+    start_time: dt.time | None = None,
+    end_time: dt.time | None = None,
+    columns: list[str] | None = None,
+) -> pl.DataFrame:
+    """
+    Rows of codes from the {in_dir}/{yyyy}/{date}.ipc files of [start_date, end_date], within [start_time, end_time] of each day.\n\n
+    e.g. read_days("transfer/etf-tick", [510050], 20240101, 20241231, dt.time(9, 30), dt.time(10, 0))
+    """
+    ipc_files = [
+        ipc_file
+        for year in range(start_date // 10000, end_date // 10000 + 1)
+        for ipc_file in sorted(glob.glob(f"{in_dir}/{year}/*.ipc"))
+        if start_date <= int(os.path.basename(ipc_file)[:-4]) <= end_date
+    ]
+    if not ipc_files:
+        return pl.DataFrame()
+    return pl.concat([read(ipc_file, codes, start_time, end_time, columns) for ipc_file in ipc_files]).collect()
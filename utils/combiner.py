@@ -1,18 +1,19 @@
 import polars as pl
 import argparse
 import os
+from utils import book, timestamp
 
 
 def combine_tick(year_month: int, in_dir: str, output_dir: str):
     in_files = f"{in_dir}/{year_month}*/*.parquet"
     print("===>reading", in_files)
 
+    lf = pl.scan_parquet(in_files)
     df = (
-        pl.scan_parquet(in_files)
-        .filter((pl.col("open") != 0) & (pl.col("last") != 0))
+        lf.filter((pl.col("open") != 0) & (pl.col("last") != 0))
         .select(
             pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
+            timestamp.to_datetime("date", "time").alias("dt"),
             pl.col("preclose").cast(pl.UInt32),
             pl.col("open").cast(pl.UInt32),
             pl.col("last").cast(pl.UInt32),
@@ -23,10 +24,7 @@ def combine_tick(year_month: int, in_dir: str, output_dir: str):
             pl.col("amount").cast(pl.UInt64).fill_null(0),
             pl.col("ask_avg_price").cast(pl.UInt32).alias("avg_ap"),
             pl.col("bid_avg_price").cast(pl.UInt32).alias("avg_bp"),
-            *[pl.col("ask_prices").list.get(i).cast(pl.UInt32).fill_null(0).alias(f"ap{i}") for i in range(10)],
-            *[pl.col("bid_prices").list.get(i).cast(pl.UInt32).fill_null(0).alias(f"bp{i}") for i in range(10)],
-            *[pl.col("ask_volumes").list.get(i).cast(pl.UInt32).fill_null(0).alias(f"av{i}") for i in range(10)],
-            *[pl.col("bid_volumes").list.get(i).cast(pl.UInt32).fill_null(0).alias(f"bv{i}") for i in range(10)],
+            *book.level_columns(lf.collect_schema().names(), {name: book.LADDERS[name] for name in ["ask_prices", "bid_prices", "ask_volumes", "bid_volumes"]}),
         )
         .sort(["code", "dt"])
         .collect()
@@ -56,7 +54,7 @@ def combine_kl1m(year_month: int, in_dir: str, output_dir: str):
         )
         .select(
             pl.col("code").cast(pl.UInt32),
-            (pl.col("date").cast(pl.Utf8) + pl.col("time").cast(pl.Utf8).str.pad_start(9, "0")).str.to_datetime("%Y%m%d%H%M%S%3f").alias("dt"),
+            timestamp.to_datetime("date", "time").alias("dt"),
             pl.col("open").cast(pl.UInt32),
             pl.col("high").cast(pl.UInt32),
             pl.col("low").cast(pl.UInt32),
@@ -99,7 +97,8 @@ def process(args):
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="history quotes combiner")
+    # run from the repo root as python -m utils.combiner, see README.md, python utils/combiner.py cannot import the utils package
+    parser = argparse.ArgumentParser(description="history quotes combiner, run from repo root: python -m utils.combiner")
     parser.add_argument("-yms", type=int, required=True, dest="ym_start", help="start year-month, 200701")
     parser.add_argument("-yme", type=int, required=True, dest="ym_end", help="end year-month, 202412")
     parser.add_argument("-st", type=str, required=True, dest="secu_type", choices=["stock", "etf"], help="security type")
@@ -0,0 +1,119 @@
+import os
+import json
+import polars as pl
+from utils import manifest
+from utils.timestamp import MS_PER_DAY
+
+# monotone within a code of a day sorted by [code, dt], stored as the difference to the previous row of the code
+DELTA_COLUMNS = ["dt", "seq_no", "ask_seq_no", "bid_seq_no", "orgin_seq_no"]
+BIT_WIDTHS = {pl.UInt8: 8, pl.Int8: 8, pl.UInt16: 16, pl.Int16: 16, pl.UInt32: 32, pl.Int32: 32, pl.UInt64: 64, pl.Int64: 64}
+NARROW_TYPES = list(BIT_WIDTHS)  # narrowest first
+
+
+def manifest_file(ipc_file: str) -> str:
+    return f"{ipc_file}.compact.json"  # transfer/stock-order/2024/20240614.ipc.compact.json
+
+
+def _narrowest(low: int, high: int) -> pl.DataType:
+    """first of NARROW_TYPES holding [low, high]"""
+    for dtype in NARROW_TYPES:
+        bits = BIT_WIDTHS[dtype]
+        if dtype.is_unsigned_integer() and 0 <= low and high < 2**bits:
+            return dtype
+        if dtype.is_signed_integer() and -(2 ** (bits - 1)) <= low and high < 2 ** (bits - 1):
+            return dtype
+    return pl.Int64
+
+
+def deltas(df: pl.DataFrame) -> tuple[pl.DataFrame, dict]:
+    """
+    First step of encode, on a day sorted by [code, dt] or on a contiguous code range of it: every integer column as Int64,
+    DELTA_COLUMNS as the difference to the last non-null value of the code (dt in ms of day), a null stays null.\n\n
+    Return the frame and its manifest without the stored dtypes, raise ValueError if the frame does not decode back to df.
+    """
+    columns = []
+    compact_manifest = {}
+    for name, dtype in df.schema.items():
+        if name == "code" or not (dtype.is_integer() or dtype == pl.Datetime("ms")):
+            continue
+        value = pl.col(name).cast(pl.Int64)
+        if name == "dt":
+            value = value % MS_PER_DAY  # the date is in the file name, rebuilt from the manifest
+        if name in DELTA_COLUMNS:
+            # against the forward-filled previous value, decode sums the deltas skipping the nulls
+            value = value - value.forward_fill().shift(1).over("code").fill_null(0)
+        columns.append(value.alias(name))
+        compact_manifest[name] = {"dtype": "Datetime" if name == "dt" else str(dtype), "delta": name in DELTA_COLUMNS}
+    if "dt" in compact_manifest:
+        compact_manifest["dt"]["day"] = int(df["dt"].cast(pl.Int64).min() // MS_PER_DAY * MS_PER_DAY) if df["dt"].count() else 0
+    df_delta = df.with_columns(columns)
+    if not _decode(df_delta.lazy(), compact_manifest).collect().equals(df):
+        raise ValueError("compact encoding does not round trip, e.g. a UInt64 beyond Int64")
+    return df_delta, compact_manifest
+
+
+def bounds(df_delta: pl.DataFrame, compact_manifest: dict, previous: dict | None = None) -> dict[str, list[int]]:
+    """column -> [min, max] of a frame of deltas, widened by the bounds of the previous frames of the same day"""
+    row = df_delta.select([pl.col(name).min().alias(f"{name}_min") for name in compact_manifest] + [pl.col(name).max().alias(f"{name}_max") for name in compact_manifest]).row(0, named=True)
+    column_bounds = {}
+    for name in compact_manifest:
+        low, high = row[f"{name}_min"], row[f"{name}_max"]
+        if previous is not None and name in previous:
+            low = previous[name][0] if low is None else min(low, previous[name][0])
+            high = previous[name][1] if high is None else max(high, previous[name][1])
+        column_bounds[name] = [low, high]
+    return column_bounds
+
+
+def narrow(compact_manifest: dict, column_bounds: dict[str, list[int]]) -> list[pl.Expr]:
+    """record the narrowest stored dtype of every column in compact_manifest, return the casts to it"""
+    for name, column in compact_manifest.items():
+        low, high = column_bounds[name]
+        column["stored"] = str(_narrowest(low or 0, high or 0))
+    return [pl.col(name).cast(getattr(pl, column["stored"])) for name, column in compact_manifest.items()]
+
+
+def encode(df: pl.DataFrame) -> tuple[pl.DataFrame, dict]:
+    """
+    Compact a day sorted by [code, dt]: DELTA_COLUMNS become per-code differences (dt in ms of day for the first row of a code),
+    then every integer column is stored in the narrowest type of its observed range.\n\n
+    Return the encoded frame and its manifest for decode, column -> {"dtype": original dtype, "delta": bool, "stored": stored dtype},
+    the dt column also records its "day" in ms since epoch.
+    """
+    df_delta, compact_manifest = deltas(df)
+    return df_delta.with_columns(narrow(compact_manifest, bounds(df_delta, compact_manifest))), compact_manifest
+
+
+def _decode(lf: pl.LazyFrame, compact_manifest: dict) -> pl.LazyFrame:
+    columns = []
+    for name, column in compact_manifest.items():
+        value = pl.col(name).cast(pl.Int64)
+        if column["delta"]:
+            value = value.cum_sum().over("code")
+        if column["dtype"] == "Datetime":
+            value = (value + column["day"]).cast(pl.Datetime("ms"))
+        else:
+            value = value.cast(getattr(pl, column["dtype"]))
+        columns.append(value.alias(name))
+    return lf.with_columns(columns)
+
+
+def decode(lf: pl.LazyFrame, ipc_file: str) -> pl.LazyFrame:
+    """
+    Original columns of a compact day file, lf is a scan of ipc_file, no-op for a plain file.\n\n
+    The deltas are summed within each code, so lf may be sliced or filtered by whole codes, but not by rows, before decode.
+    """
+    if not os.path.exists(manifest_file(ipc_file)):
+        return lf
+    with open(manifest_file(ipc_file), "r") as file:
+        return _decode(lf, json.load(file))
+
+
+def write_manifest(compact_manifest: dict, ipc_file: str):
+    manifest.write_json(manifest_file(ipc_file), compact_manifest)
+
+
+def remove(ipc_file: str):
+    """drop the manifest of a rewritten plain ipc_file"""
+    if os.path.exists(manifest_file(ipc_file)):
+        os.remove(manifest_file(ipc_file))
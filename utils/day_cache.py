@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+import polars as pl
+from utils import compact, tier
+
+# per-process LRU of decoded day files, off until set_budget
+_lock = threading.Lock()
+_entries = OrderedDict()  # (secu, qt, date, columns) -> ((mtime_ns, size), df, nbytes), least recently used first
+_budget = 0
+_bytes = 0
+_counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def _evict(max_bytes: int):
+    global _bytes
+    while _entries and _bytes > max_bytes:
+        _, (_, _, nbytes) = _entries.popitem(last=False)
+        _bytes -= nbytes
+        _counters["evictions"] += 1
+
+
+def set_budget(max_bytes: int):
+    """bytes of decoded frames kept in this process, 0 turns the cache off and drops everything"""
+    global _budget
+    with _lock:
+        _budget = max_bytes
+        _evict(max_bytes)
+
+
+def budget() -> int:
+    return _budget
+
+
+def stats() -> dict:
+    """hits, misses, evictions, invalidations (the file changed since cached), entries, bytes and budget, to tune the budget"""
+    with _lock:
+        return {**_counters, "entries": len(_entries), "bytes": _bytes, "budget": _budget}
+
+
+def clear():
+    """drop every entry and reset the counters"""
+    global _bytes
+    with _lock:
+        _entries.clear()
+        _bytes = 0
+        _counters.update({name: 0 for name in _counters})
+
+
+def schema(ipc_file: str, columns: list[str] | None = None) -> pl.Schema:
+    """decoded schema of the columns of a day file, from its metadata"""
+    schema = compact.decode(tier.scan_ipc([ipc_file]), ipc_file).collect_schema()
+    return pl.Schema({name: schema[name] for name in columns}) if columns else schema
+
+
+def fits(ipc_file: str, columns: list[str] | None = None) -> bool:
+    """the decoded columns of a day file fit in the budget, estimated from its row count and fixed-width dtypes without decoding"""
+    if _budget <= 0:
+        return False
+    rows = tier.scan_ipc([ipc_file]).select(pl.len()).collect().item()
+    row_bytes = pl.DataFrame(schema=schema(ipc_file, columns)).clear(1024).estimated_size() / 1024
+    return rows * row_bytes <= _budget
+
+
+def read(secu: str, qt: str, target_date: int, ipc_file: str, columns: list[str] | None = None) -> pl.DataFrame:
+    """
+    The decoded columns of a day file, from the cache if the file is unchanged since it was cached.\n\n
+    A frame larger than the whole budget is returned without being cached.
+    """
+    global _bytes
+    key = (secu, qt, target_date, tuple(columns) if columns else None)
+    stat = os.stat(ipc_file)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+            _entries.move_to_end(key)
+            _counters["hits"] += 1
+            return entry[1]
+        if entry is not None:
+            # rewritten by dt_combiner, genbar or the recompress job
+            del _entries[key]
+            _bytes -= entry[2]
+            _counters["invalidations"] += 1
+        _counters["misses"] += 1
+
+    # decode outside the lock, other threads keep hitting
+    lf = compact.decode(tier.scan_ipc([ipc_file]), ipc_file)
+    df = (lf.select(columns) if columns else lf).collect()
+    nbytes = df.estimated_size()
+    with _lock:
+        if 0 < nbytes <= _budget and key not in _entries:
+            _entries[key] = ((stat.st_mtime_ns, stat.st_size), df, nbytes)
+            _bytes += nbytes
+            _evict(_budget)
+    return df
@@ -0,0 +1,71 @@
+import os
+import json
+from utils import manifest
+
+
+def deps_file(out_file: str) -> str:
+    return f"{out_file}.deps.json"  # transfer/etf-tick/2022/20220104.ipc.deps.json
+
+
+def fingerprint(in_files: list[str]) -> list[list]:
+    """[path, size, mtime_ns] of every input, an input rewritten upstream changes its mtime"""
+    fingerprints = []
+    for in_file in sorted(in_files):
+        stat = os.stat(in_file)
+        fingerprints.append([in_file.replace("\\", "/"), stat.st_size, stat.st_mtime_ns])
+    return fingerprints
+
+
+def _layout(layout: dict | None) -> dict:
+    """only the options turned on, an output recorded before an option existed matches it turned off"""
+    return {name: value for name, value in (layout or {}).items() if value}
+
+
+def day_layout(hot: bool, indexed: bool = False, compacted: bool = False, book_arrays: bool = False) -> dict:
+    """the layout options of a transfer day, every writer and every freshness check builds it here so they never disagree"""
+    return {"hot": hot, "indexed": indexed, "compacted": compacted, "book_arrays": book_arrays}
+
+
+def read(out_file: str) -> dict | None:
+    """{"inputs": fingerprints, "layout": options} recorded for out_file, None if never recorded"""
+    if not os.path.exists(deps_file(out_file)):
+        return None
+    with open(deps_file(out_file), "r") as file:
+        recorded = json.load(file)
+    if isinstance(recorded, list):
+        return {"inputs": recorded, "layout": {}}  # recorded before the layout was
+    return recorded
+
+
+def write(out_file: str, recorded: dict):
+    manifest.write_json(deps_file(out_file), recorded)
+
+
+def is_fresh(out_file: str, in_files: list[str], layout: dict | None = None) -> bool:
+    """
+    the output exists and was built from exactly the current inputs, in the layout asked for,
+    see day_layout, turning an option on or off rebuilds the output
+    """
+    recorded = read(out_file) if os.path.exists(out_file) else None
+    if recorded is None:
+        return False
+    return recorded["inputs"] == fingerprint(in_files) and recorded["layout"] == _layout(layout)
+
+
+def has_layout(out_file: str, layout: dict | None = None) -> bool:
+    """the output exists in the layout asked for, whatever its inputs, an output never recorded has every option off"""
+    if not os.path.exists(out_file):
+        return False
+    recorded = read(out_file)
+    return (recorded["layout"] if recorded else {}) == _layout(layout)
+
+
+def record(out_file: str, in_files: list[str], layout: dict | None = None):
+    """remember the inputs and the layout options of a freshly written output"""
+    write(out_file, {"inputs": fingerprint(in_files), "layout": _layout(layout)})
+
+
+def relayout(out_file: str, layout: dict | None = None):
+    """record the new layout of an output rewritten from itself, its recorded inputs stay"""
+    recorded = read(out_file)
+    write(out_file, {"inputs": recorded["inputs"] if recorded else [], "layout": _layout(layout)})
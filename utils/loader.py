@@ -0,0 +1,112 @@
+import os
+import glob
+import itertools
+import polars as pl
+from utils import code_index, compact, day_cache, tier
+
+ROOT = "transfer"  # transfer/{secu}-{qt}/{yyyy}/{date}.ipc
+
+_partitions = {}  # year dir -> (mtime_ns, dates), refreshed when a day is added or removed
+
+
+def _year_dates(year_dir: str) -> list[int]:
+    mtime_ns = os.stat(year_dir).st_mtime_ns
+    cached = _partitions.get(year_dir)
+    if cached is None or cached[0] != mtime_ns:
+        dates = sorted(int(name[:-4]) for name in os.listdir(year_dir) if name.endswith(".ipc") and name[:-4].isdigit())
+        _partitions[year_dir] = cached = (mtime_ns, dates)
+    return cached[1]
+
+
+def catalog(root: str = ROOT) -> dict[tuple[str, str], list[int]]:
+    """(secu, qt) -> dates available under root, e.g. {("etf", "tick"): [20220104, ...], ("etf", "bar1m"): [...]}"""
+    datasets = {}
+    for dataset_dir in sorted(glob.glob(f"{root}/*-*")):
+        secu, qt = os.path.basename(dataset_dir).split("-", 1)
+        datasets[(secu, qt)] = dates(secu, qt, root=root)
+    return datasets
+
+
+def dates(secu: str, qt: str, start: int = 0, end: int = 99999999, root: str = ROOT) -> list[int]:
+    """available dates of a dataset within [start, end], only the year dirs of the range are listed"""
+    dataset_dir = f"{root}/{secu}-{qt}"
+    years = [int(name) for name in os.listdir(dataset_dir) if name.isdigit()] if os.path.isdir(dataset_dir) else []
+    return [
+        target_date
+        for year in sorted(years)
+        if start // 10000 <= year <= end // 10000
+        for target_date in _year_dates(f"{dataset_dir}/{year}")
+        if start <= target_date <= end
+    ]
+
+
+def load(
+    secu: str,
+    qt: str,
+    codes: list[int] | None = None,
+    start: int = 0,
+    end: int = 99999999,
+    columns: list[str] | None = None,
+    root: str = ROOT,
+) -> pl.LazyFrame:
+    """
+    Lazy frame of a dataset over the days of [start, end], nothing is read until collect.\n\n
+    Days are pruned by the catalog, columns and the code filter are pushed down to the scans,
+    the days with a code index are read by per-code slices, see utils.code_index, compact days are decoded, see utils.compact.
+    With a day_cache budget, every day that fits in it is decoded once per process at its first load, not at collect, and later loads of it hit the cache,
+    a larger day is read lazily as without the cache, see utils.day_cache.
+    Args:
+        secu: str, e.g. etf, stock
+        qt: str, e.g. tick, order, trade, kl1m, bar1m, bar15m
+        codes: list[int], e.g. [510050, 510300], None means all codes
+        start, end: int, dates like 20240614, both included
+        columns: list[str], None means all columns
+    e.g. load("etf", "bar1m", [510050], 20240101, 20241231, ["code", "dt", "close"]).collect()
+    """
+    target_dates = dates(secu, qt, start, end, root)
+    ipc_files = [f"{root}/{secu}-{qt}/{target_date // 10000}/{target_date}.ipc" for target_date in target_dates]
+    if not ipc_files:
+        return pl.LazyFrame()
+
+    # whole days of the projected columns are cached, so other codes of the same day hit too
+    read_columns = columns if columns is None or codes is None or "code" in columns else [*columns, "code"]
+    file_dates = dict(zip(ipc_files, target_dates))
+
+    def kind(ipc_file: str) -> str:
+        if day_cache.fits(ipc_file, read_columns):
+            return "cached"
+        if codes is not None and os.path.exists(code_index.index_file(ipc_file)):
+            return "indexed"
+        if os.path.exists(compact.manifest_file(ipc_file)):
+            return "compact"
+        return "hot" if tier.is_hot(ipc_file) else "cold"
+
+    # consecutive days of the same kind share one scan, hot days are memory-mapped, the frame stays in date order
+    frames = []
+    for file_kind, kind_files in itertools.groupby(ipc_files, key=kind):
+        if file_kind == "cached":
+            # read here rather than deferred to collect, a nested collect inside a query source deadlocks older polars,
+            # a day larger than the budget took one of the lazy paths below
+            for ipc_file in kind_files:
+                lf = day_cache.read(secu, qt, file_dates[ipc_file], ipc_file, read_columns).lazy()
+                if codes is not None:
+                    lf = lf.filter(pl.col("code").is_in([int(code) for code in codes]))
+                frames.append(lf.select(columns) if columns else lf)
+            continue
+        if file_kind == "indexed":
+            frames += [code_index.read(ipc_file, codes, columns=columns) for ipc_file in kind_files]
+            continue
+        if file_kind == "compact":
+            # every compact day has its own manifest, decoded after the code filter
+            for ipc_file in kind_files:
+                lf = tier.scan_ipc([ipc_file])
+                if codes is not None:
+                    lf = lf.filter(pl.col("code").is_in([int(code) for code in codes]))
+                lf = compact.decode(lf, ipc_file)
+                frames.append(lf.select(columns) if columns else lf)
+            continue
+        lf = tier.scan_ipc(list(kind_files))
+        if codes is not None:
+            lf = lf.filter(pl.col("code").is_in([int(code) for code in codes]))
+        frames.append(lf.select(columns) if columns else lf)
+    return pl.concat(frames)
@@ -0,0 +1,33 @@
+import os
+import json
+
+MANIFEST_FILE = "_manifest.json"
+
+
+def read_manifest(date_dir: str) -> dict | None:
+    """read the manifest of a downloaded date directory, None if the date is not complete"""
+    manifest_file = f"{date_dir}/{MANIFEST_FILE}"
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r") as file:
+        return json.load(file)
+
+
+def write_json(json_file: str, obj, indent: int | None = None):
+    """write json through a temp file and rename, a reader never sees a half-written file, shared by every sidecar"""
+    tmp_file = f"{json_file}.tmp"
+    with open(tmp_file, "w") as file:
+        json.dump(obj, file, indent=indent)
+    os.replace(tmp_file, json_file)
+
+
+def write_manifest(date_dir: str, manifest: dict):
+    """seal or update a date directory, see write_json"""
+    os.makedirs(date_dir, exist_ok=True)
+    write_json(f"{date_dir}/{MANIFEST_FILE}", manifest, indent=2)
+
+
+def is_complete(date_dir: str) -> bool:
+    """a date directory is sealed once its complete manifest exists, no chunk is added or rewritten afterwards"""
+    manifest = read_manifest(date_dir)
+    return manifest is not None and manifest.get("complete", False)
@@ -0,0 +1,92 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+UP_TO_DATE = "up to date"  # result of a day skipped because its output is fresh
+MISSING = "missing"  # result of a day skipped because its input is not there, e.g. a holiday or not downloaded yet
+WORKER_DIED = "failed, a worker process died, e.g. killed out of memory"  # result of the days running in a broken pool
+
+
+def run_days(func, jobs, num_procs: int = 1, mem_budget: int = 0) -> dict:
+    """
+    Run func(*args) for every (target_date, args, mem_bytes) of jobs, return target_date -> "ok" or the failure reason.\n\n
+    Args:
+        func: a module level function, it is pickled to the worker processes
+        jobs: iterable of (target_date, args, mem_bytes), consumed lazily, so it may block until a date is ready
+        num_procs: int, number of worker processes, 1 runs every day in this process
+        mem_budget: int, bytes, a day is started only if the estimated memory of the running days stays within it,
+            0 means no limit, a day larger than the budget still runs alone
+    """
+    results = {}
+    if num_procs <= 1:
+        for target_date, args, _ in jobs:
+            try:
+                func(*args)
+                results[target_date] = "ok"
+            except Exception as e:
+                results[target_date] = f"failed, {e}"
+        return results
+
+    jobs = iter(jobs)
+    pending = None
+    running = {}  # future -> (target_date, mem_bytes)
+    # spawn, polars' thread pool does not survive a fork
+    executor = ProcessPoolExecutor(num_procs, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        while True:
+            while len(running) < num_procs:
+                if pending is None:
+                    pending = next(jobs, None)
+                    if pending is None:
+                        break
+                target_date, args, mem_bytes = pending
+                mem_used = sum(mem for _, mem in running.values())
+                if running and mem_budget > 0 and mem_used + mem_bytes > mem_budget:
+                    break
+                try:
+                    running[executor.submit(func, *args)] = (target_date, mem_bytes)
+                except BrokenProcessPool:
+                    # broken before the wait below saw it, pending is submitted again to the new pool
+                    executor = _restart(executor, num_procs, running, results)
+                    continue
+                pending = None
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                target_date, _ = running.pop(future)
+                try:
+                    future.result()
+                    results[target_date] = "ok"
+                except BrokenProcessPool:
+                    broken = True
+                    results[target_date] = WORKER_DIED
+                except Exception as e:
+                    results[target_date] = f"failed, {e}"
+            if broken:
+                executor = _restart(executor, num_procs, running, results)
+    finally:
+        executor.shutdown()
+    return results
+
+
+def _restart(executor: ProcessPoolExecutor, num_procs: int, running: dict, results: dict) -> ProcessPoolExecutor:
+    """a dead worker breaks the whole pool, fail the days still running in it and start a new pool for the remaining days"""
+    for target_date, _ in running.values():
+        results[target_date] = WORKER_DIED
+    running.clear()
+    executor.shutdown(wait=False)
+    return ProcessPoolExecutor(num_procs, mp_context=multiprocessing.get_context("spawn"))
+
+
+def summarize(results: dict) -> str:
+    """one line summary of run_days results, with the reason of every day that is neither ok, up to date nor missing"""
+    failed = {target_date: reason for target_date, reason in sorted(results.items()) if reason not in ["ok", UP_TO_DATE, MISSING]}
+    skipped = sum(reason == UP_TO_DATE for reason in results.values())
+    missing = sum(reason == MISSING for reason in results.values())
+    summary = f"{len(results) - len(failed) - skipped - missing} ok, {skipped} up to date, {missing} missing, {len(failed)} failed"
+    if failed:
+        summary += ": " + "; ".join(f"{target_date} {reason}" for target_date, reason in failed.items())
+    return summary
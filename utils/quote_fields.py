@@ -0,0 +1,18 @@
+def extract_field(quote: str, key: str) -> str | None:
+    """
+    Slice the raw value of a scalar field out of an eqapi quote json string, without parsing the whole quote.\n\n
+    Args:
+        quote: str, example: ' {"0":"510050","1":259,"3":20220105,"4":92500000,...}'
+        key: str, example: "3"
+    """
+    idx = quote.find(f'"{key}":')
+    if idx < 0:
+        return None
+    start = idx + len(key) + 3
+    end = quote.find(",", start)
+    return quote[start:end] if end > 0 else quote[start:-1]
+
+
+def extract_date(quote: str) -> str | None:
+    """date of the quote, field "3" """
+    return extract_field(quote, "3")
@@ -0,0 +1,75 @@
+from functools import cache
+from typing import NamedTuple
+import numpy as np
+import polars as pl
+from utils.timestamp import MS_PER_DAY
+
+MS_PER_MINUTE = 60_000
+MINUTES_PER_DAY = 24 * 60
+
+# HHMMSSmmm times of the quote api requests
+AUCTION_OPEN_TIME = 91500000  # opening call auction begins, orders and trades are requested from here
+AUCTION_MATCH_TIME = 92500000  # opening call auction matched, ticks are requested from here
+END_TIME = 150100000  # a minute past the close, so the quotes stamped 15:00 are included
+
+
+def minute_of(hour: int, minute: int = 0) -> int:
+    """minute of day, minute_of(9, 30) -> 570"""
+    return hour * 60 + minute
+
+
+class Template(NamedTuple):
+    """trading day in minutes of day, bars are labeled by the right end of their minute"""
+
+    auctions: tuple[int, ...]  # labels of the call auction bars
+    sessions: tuple[tuple[int, int], ...]  # (open, close] of the continuous sessions, a bar per minute
+
+
+# 09:26 for the opening call auction, [09:31, ...11:30], [13:01, ...15:00]
+A_SHARE = Template(
+    auctions=(minute_of(9, 26),),
+    sessions=((minute_of(9, 30), minute_of(11, 30)), (minute_of(13), minute_of(15))),
+)
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False  # shared by every caller through the cache
+    return array
+
+
+@cache
+def labels(template: Template = A_SHARE) -> np.ndarray:
+    """minutes of day of the aligned bar1m, one slot each"""
+    minutes = list(template.auctions)
+    for open_minute, close_minute in template.sessions:
+        minutes += range(open_minute + 1, close_minute + 1)
+    return _read_only(np.array(minutes))
+
+
+@cache
+def offsets(template: Template = A_SHARE) -> np.ndarray:
+    """milliseconds since midnight of the aligned bar1m labels, add to the date to get the bar dt"""
+    return _read_only(labels(template) * MS_PER_MINUTE)
+
+
+@cache
+def slot_table(template: Template = A_SHARE) -> np.ndarray:
+    """
+    minute of day of a tick -> its slot in labels, -1 for the minutes without an aligned bar.\n\n
+    The close minute of a session (11:30:xx, 15:00:xx) belongs to the session's last bar.
+    """
+    table = np.full(MINUTES_PER_DAY, -1)
+    table[labels(template) - 1] = np.arange(len(labels(template)))
+    for _, close_minute in template.sessions:
+        table[close_minute] = table[close_minute - 1]
+    return _read_only(table)
+
+
+def slots(ms: np.ndarray, template: Template = A_SHARE) -> np.ndarray:
+    """slots of the ticks of one day, ms is milliseconds since epoch or since midnight"""
+    return slot_table(template)[ms % MS_PER_DAY // MS_PER_MINUTE]
+
+
+def minute_of_day(dt: pl.Expr) -> pl.Expr:
+    """minute of day of a Datetime[ms] expression, integer math instead of dt.time()"""
+    return dt.cast(pl.Int64) % MS_PER_DAY // MS_PER_MINUTE
@@ -0,0 +1,104 @@
+import os
+import glob
+import json
+import datetime as dt
+import polars as pl
+from utils import code_index, deps
+
+HOT_COMPRESSION = "uncompressed"  # memory-mappable, polars reads it without a copy, "lz4" is smaller but decompressed on read
+COLD_COMPRESSION = "zstd"
+
+
+def hot_marker(ipc_file: str) -> str:
+    return f"{ipc_file}.hot"  # transfer/etf-tick/2022/20220104.ipc.hot
+
+
+def is_hot(ipc_file: str) -> bool:
+    return os.path.exists(hot_marker(ipc_file))
+
+
+def hot_dates(hot_days: int, today: dt.date | None = None) -> set[int]:
+    """the last hot_days trading days up to today, from calendar/{year}.json, the calendar of the current year is required"""
+    if hot_days <= 0:
+        return set()
+    today = today or dt.date.today()
+    today_int = today.year * 10000 + today.month * 100 + today.day
+    if not os.path.exists(f"calendar/{today.year}.json"):
+        # without it, the last days of the previous year would be hot and today's data never
+        raise FileNotFoundError(f"calendar/{today.year}.json not found, needed to pick the hot days")
+    trading_days = []
+    for year in range(today.year - 1, today.year + 1):
+        if os.path.exists(f"calendar/{year}.json"):
+            with open(f"calendar/{year}.json", "r") as file:
+                trading_days += json.load(file)
+    return set([trading_day for trading_day in trading_days if trading_day <= today_int][-hot_days:])
+
+
+def compression(hot: bool) -> str:
+    return HOT_COMPRESSION if hot else COLD_COMPRESSION
+
+
+def mark(ipc_file: str, hot: bool):
+    """record the tier of an ipc file written with compression(hot), called after the file is in place"""
+    if hot:
+        open(hot_marker(ipc_file), "w").close()
+    elif os.path.exists(hot_marker(ipc_file)):
+        os.remove(hot_marker(ipc_file))
+
+
+def scan_ipc(ipc_files: list[str]) -> pl.LazyFrame:
+    """scan ipc files, memory-mapped only if all of them are hot, so cold files are never locked by a map"""
+    return pl.scan_ipc(ipc_files, memory_map=all(is_hot(ipc_file) for ipc_file in ipc_files))
+
+
+def recompress(root: str, hot_days: int, today: dt.date | None = None) -> dict:
+    """
+    Rewrite the hot files under root/{secu}-{qt}/{yyyy}/{date}.ipc that aged out of the last hot_days trading days as zstd.\n\n
+    The deps sidecars that recorded a recompressed file are updated, so the downstream outputs stay up to date.
+    Return ipc_file -> "ok" or the reason it is kept hot, e.g. mapped by a reader on Windows.
+    """
+    keep = hot_dates(hot_days, today)
+    aged = [
+        ipc_file.replace("\\", "/")
+        for ipc_file in sorted(glob.glob(f"{root}/*/*/*.ipc"))
+        if is_hot(ipc_file) and int(os.path.basename(ipc_file)[:-4]) not in keep
+    ]
+    if not aged:
+        return {}
+
+    # recompressed file -> outputs whose deps sidecar records it
+    recorded_by = {}
+    for sidecar in glob.glob(f"{root}/*/*/*.deps.json"):
+        out_file = sidecar[: -len(".deps.json")]
+        for in_file, _, _ in deps.read(out_file)["inputs"]:
+            recorded_by.setdefault(in_file, []).append(out_file)
+
+    results = {}
+    for ipc_file in aged:
+        old_fingerprint = deps.fingerprint([ipc_file])[0]
+        try:
+            df = pl.read_ipc(ipc_file, memory_map=False)
+            if os.path.exists(code_index.index_file(ipc_file)):
+                df = code_index.by_code(df)  # keep one record batch per code, the rows and the index do not change
+            df.write_ipc(f"{ipc_file}.tmp", compression=COLD_COMPRESSION)
+            os.replace(f"{ipc_file}.tmp", ipc_file)
+        except (OSError, pl.exceptions.PolarsError) as e:
+            if os.path.exists(f"{ipc_file}.tmp"):
+                os.remove(f"{ipc_file}.tmp")
+            results[ipc_file] = f"kept hot, {e}"
+            continue
+        mark(ipc_file, False)
+
+        # the file itself is cold now, a run without it among the hot days finds it up to date
+        recorded = deps.read(ipc_file)
+        if recorded is not None and recorded["layout"].pop("hot", None):
+            deps.write(ipc_file, recorded)
+        new_fingerprint = deps.fingerprint([ipc_file])[0]
+        for out_file in recorded_by.get(ipc_file, []):
+            recorded = deps.read(out_file)
+            # only the outputs that were up to date with the hot file, the stale ones stay stale
+            if old_fingerprint in recorded["inputs"]:
+                recorded["inputs"][recorded["inputs"].index(old_fingerprint)] = new_fingerprint
+                deps.write(out_file, recorded)
+        results[ipc_file] = "ok"
+    return results